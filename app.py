@@ -1,24 +1,428 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from collections import deque
+import atexit
+import fcntl
+import gzip
+import hashlib
+import hmac
+import importlib
+import io
+import itertools
+import json
+import logging
+import logging.handlers
 import math
+import mimetypes
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
 import time
+import tracemalloc
+import urllib.error
+import urllib.request
 import os
 
+import sharding
+
 # Create Flask app
 app = Flask(__name__)
 
+# CORS_MODE=same-origin disables CORS entirely, for deployments that serve the
+# frontend from this app (SERVE_FRONTEND=1) and so never see cross-origin calls
+CORS_MODE = os.environ.get('CORS_MODE', 'open')
+
+# How long browsers may cache a preflight response, in seconds
+CORS_MAX_AGE = int(os.environ.get('CORS_MAX_AGE', '86400'))
+
 # Configure CORS with more permissive settings
-CORS(app, resources={
-    r"/*": {
-        "origins": "*",  # Allow all origins
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
+if CORS_MODE != 'same-origin':
+    CORS(app, resources={
+        r"/*": {
+            "origins": "*",  # Allow all origins
+            "methods": ["GET", "POST", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization", "Last-Event-ID"],
+            "expose_headers": ["Retry-After", "X-Advised-FPS"],
+            "max_age": CORS_MAX_AGE
+        }
+    })
+
+# Optional or heavy dependencies (brotli, cProfile, shared memory) are imported
+# on first use so new workers boot fast
+_lazy_modules = {}
+
+# Optional subsystems worth importing in the gunicorn master under --preload,
+# so forked workers share them copy-on-write instead of importing them again
+PRELOAD_MODULES = []
+
+
+def lazy_import(name):
+    """Import a module on first use and cache it"""
+    module = _lazy_modules.get(name)
+    if module is None:
+        module = _lazy_modules[name] = importlib.import_module(name)
+    return module
+
+
+def warm_up():
+    """Import optional subsystems ahead of time (used when preloading)"""
+    for name in PRELOAD_MODULES:
+        try:
+            lazy_import(name)
+        except ImportError:
+            # Optional dependency not installed; its subsystem stays disabled
+            pass
+
+# Signal processing for the rep state machines: a position change is only
+# accepted once the metric has stayed in the new zone of its hysteresis band
+# for MIN_DWELL_FRAMES consecutive frames, and metrics are smoothed with an
+# exponential moving average (alpha 1.0 disables smoothing). Both are counted
+# in frames rather than milliseconds, so counting works at any frame rate.
+DEFAULT_SIGNAL_PARAMS = {
+    'minDwell': int(os.environ.get('MIN_DWELL_FRAMES', '2')),
+    'alpha': float(os.environ.get('SMOOTHING_ALPHA', '0.7'))
+}
+
+# Minimum wrist rise (normalized image height) that counts as pressing upwards
+PRESS_MIN_RISE = 0.05
+
+# Custom exercises are defined in a JSON config file, compiled at load time and
+# hot reloaded when the file changes (checked at most every few seconds)
+EXERCISE_CONFIG = os.environ.get('EXERCISE_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exercises.json'))
+EXERCISE_RELOAD_INTERVAL = float(os.environ.get('EXERCISE_RELOAD_INTERVAL', '2'))
+_exercise_config_mtime = None
+_exercise_config_checked = 0.0
+_exercise_reload_lock = threading.Lock()
+custom_exercises = {}
+
+# MediaPipe Pose always reports this many landmarks per frame
+LANDMARK_COUNT = 33
+
+# Session IDs key every per-session store and the snapshot, so keep them short
+MAX_SESSION_ID_LENGTH = 128
+
+# Landmarks reported below this MediaPipe visibility are treated as occluded
+VISIBILITY_THRESHOLD = float(os.environ.get('VISIBILITY_THRESHOLD', '0.5'))
+
+
+def joint_mask(*indices):
+    """Build a bitmask with one bit per landmark index"""
+    mask = 0
+    for index in indices:
+        mask |= 1 << index
+    return mask
+
+
+# Joint groups as bitmasks over the 33 landmarks, so a visibility check is one AND
+ALL_VISIBLE = (1 << 33) - 1
+LEFT_ARM = joint_mask(11, 13, 15)
+RIGHT_ARM = joint_mask(12, 14, 16)
+SHOULDERS = joint_mask(11, 12)
+HIPS = joint_mask(23, 24)
+LEFT_LEG = joint_mask(23, 25, 27)
+RIGHT_LEG = joint_mask(24, 26, 28)
+LEFT_FOOT = joint_mask(27, 29, 31)
+RIGHT_FOOT = joint_mask(28, 30, 32)
+
+# A frame is skipped outright unless at least one of these groups is fully visible
+EXERCISE_JOINT_GROUPS = {
+    'bicepCurl': (LEFT_ARM, RIGHT_ARM),
+    'squat': (LEFT_LEG, RIGHT_LEG),
+    'pushup': (LEFT_ARM, RIGHT_ARM),
+    'shoulderPress': (LEFT_ARM, RIGHT_ARM),
+    'tricepExtension': (LEFT_ARM, RIGHT_ARM),
+    'lunge': (LEFT_LEG, RIGHT_LEG),
+    'calfRaises': (LEFT_FOOT, RIGHT_FOOT)
+}
+
+# Error codes returned for rejected payloads
+PAYLOAD_ERRORS = {
+    'INVALID_JSON': 'Request body must be a JSON object',
+    'LANDMARKS_NOT_LIST': 'landmarks must be a list',
+    'LANDMARKS_LENGTH': f'landmarks must contain exactly {LANDMARK_COUNT} points',
+    'LANDMARK_NOT_OBJECT': 'each landmark must be an object',
+    'LANDMARK_NOT_NUMERIC': 'landmark x, y, z and visibility must be numbers',
+    'INVALID_PAYLOAD': 'landmark values must be finite numbers',
+    'UNKNOWN_EXERCISE': 'Unknown exerciseType',
+    'INVALID_SESSION': f'sessionId must be a string of at most {MAX_SESSION_ID_LENGTH} characters',
+    'SESSION_MISMATCH': 'sessionId in the query string must match the body'
+}
+
+# Errors are logged through a queue drained by a background thread, so request
+# threads never block on log I/O, and each error code is rate limited
+LOG_RATE_PER_SEC = float(os.environ.get('LOG_RATE_PER_SEC', '5'))
+LOG_BURST = 10
+logger = logging.getLogger('exercise_counter')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener_pid = None
+_log_buckets = {}
+error_counts = {}
+
+# Token required by the debug and admin endpoints; they are disabled when unset.
+# It is only accepted in the X-Admin-Token header, never the query string, so
+# it stays out of proxy and access logs.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Request profiling: opt in per request with an "X-Profile: 1" header (or
+# "full" for cProfile output) sent with the admin token in X-Admin-Token, or
+# sample a fraction of all requests
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_CPROFILE = os.environ.get('PROFILE_CPROFILE', '0') == '1'
+if PROFILE_CPROFILE:
+    PRELOAD_MODULES += ['cProfile', 'pstats']
+recent_profiles = deque(maxlen=100)
+_profile_local = threading.local()
+_profiles_in_flight = 0
+_profile_lock = threading.Lock()
+
+# Cost accounting for /debug/costs: thread CPU time spent counting each frame is
+# accumulated per exercise type and per session, and a sample of frames
+# (COST_ALLOC_SAMPLE_RATE) is run under tracemalloc to measure the memory each
+# exercise allocates per frame. tracemalloc sees every thread's allocations, so a
+# frame is only sampled while no other request is in flight; ring consumers and
+# open event streams can still add to a sample, so allocation figures are upper
+# bounds. State bytes are measured when the report is built.
+COST_ACCOUNTING = os.environ.get('COST_ACCOUNTING', '1') == '1'
+COST_ALLOC_SAMPLE_RATE = float(os.environ.get('COST_ALLOC_SAMPLE_RATE', '0.001'))
+COST_MAX_SESSIONS = 10000  # Cheapest half is dropped past this
+exercise_costs = {}
+session_costs = {}
+_alloc_sample_lock = threading.Lock()
 
 # Global state storage (could be replaced with a database in production)
 exercise_states = {}
 
+# Per-exercise spec for rep analytics:
+# (left metric key, right metric key, extreme at which the rep is counted,
+#  whether the movement toward that extreme is the concentric phase)
+REP_METRIC_SPECS = {
+    'bicepCurl': ('L', 'R', 'min', True),
+    'squat': ('L', 'R', 'min', False),
+    'pushup': ('L', 'R', 'min', False),
+    'shoulderPress': ('L', 'R', 'max', True),
+    'tricepExtension': ('L', 'R', 'max', True),
+    'lunge': ('LLeg', 'RLeg', 'min', False),
+    'calfRaises': ('LHeelLift', 'RHeelLift', 'max', True)
+}
+
+# Constant-size streaming workout aggregates per session ID
+session_summaries = {}
+
+# Gaps between frames longer than this are not counted as active time
+ACTIVE_GAP_MS = 5000
+
+# Every page load starts a new session, so sessions idle for SESSION_TTL seconds
+# are dropped from every per-session store (swept every SESSION_SWEEP_INTERVAL)
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '3600'))
+SESSION_SWEEP_INTERVAL = 60
+_sessions_swept = time.monotonic()
+
+# Admission control for /process_landmarks: token buckets per client IP and per
+# sessionId, plus a cap on how many new sessions one IP may start per minute.
+# Over-limit requests get a 429 with Retry-After; the IP check (and the session
+# check, when sessionId is in the query string) runs before the body is parsed.
+# A query-string sessionId must match the one in the body, so the bucket that
+# was charged is the session that gets processed. TRUST_PROXY_HEADERS is the
+# number of proxies in front of the app (Render's, router.py) whose
+# X-Forwarded-For entries are trusted; the Procfile sets it to 1. With 0 every
+# client shares the proxy's address.
+RATE_LIMIT_IP_RPS = float(os.environ.get('RATE_LIMIT_IP_RPS', '120'))
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '240'))
+RATE_LIMIT_SESSION_RPS = float(os.environ.get('RATE_LIMIT_SESSION_RPS', '35'))
+RATE_LIMIT_SESSION_BURST = float(os.environ.get('RATE_LIMIT_SESSION_BURST', '70'))
+NEW_SESSIONS_PER_MINUTE = float(os.environ.get('NEW_SESSIONS_PER_MINUTE', '30'))
+TRUST_PROXY_HEADERS = int(os.environ.get('TRUST_PROXY_HEADERS', '0'))
+RATE_LIMIT_MAX_BUCKETS = 100000
+ip_buckets = {}
+session_buckets = {}
+new_session_buckets = {}
+
+# Live session state is snapshotted to local disk so worker restarts and
+# rolling deploys don't reset users. Only sessions changed since the last
+# snapshot are appended (as compact JSON lines) every SNAPSHOT_INTERVAL
+# seconds; the log is compacted once it grows past SNAPSHOT_COMPACT_BYTES.
+# Each worker keeps reading the log: sessions it restored and hasn't touched
+# since are replaced by newer records, so a worker started by a rolling restart
+# picks up the old worker's final flush (on the next snapshot tick, or as soon
+# as the session is used). Disabled unless SNAPSHOT_DIR is set.
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', '5'))
+SNAPSHOT_COMPACT_BYTES = int(os.environ.get('SNAPSHOT_COMPACT_BYTES', str(8 * 1024 * 1024)))
+SNAPSHOT_TTL = int(os.environ.get('SNAPSHOT_TTL', str(SESSION_TTL)))  # Sessions idle longer are not restored
+dirty_clients = set()
+dirty_sessions = set()
+restored_at = {}  # (kind, key) -> record time, for restored sessions not touched since
+_snapshot_pid = None
+_snapshot_lock = threading.Lock()
+_snapshot_read_lock = threading.Lock()
+_snapshot_offset = 0
+_snapshot_inode = None
+
+# Sharding across nodes: when CLUSTER_CONFIG names a cluster config file (see
+# sharding.py), session IDs are mapped to nodes by consistent hashing and this
+# node (NODE_URL, as listed in the config) answers 421 with the owner for
+# sessions it doesn't own. A background thread watches the file; on a
+# membership change each node pushes the sessions it no longer owns to their
+# new owner through /admin/handoff (authenticated with the shared ADMIN_TOKEN),
+# so a node removed from the list drains. Failed handoffs are retried with
+# backoff. Frames the new owner counts before the handoff lands are merged
+# with the handed-off copy rather than overwritten. Route frames with
+# router.py, or have clients look up their node via /shards. A node is one
+# process: run a single worker per node and scale by adding nodes.
+CLUSTER_CONFIG = os.environ.get('CLUSTER_CONFIG')
+NODE_URL = os.environ.get('NODE_URL', '').rstrip('/')
+CLUSTER_RELOAD_INTERVAL = float(os.environ.get('CLUSTER_RELOAD_INTERVAL', '2'))
+HANDOFF_BATCH = 500  # Sessions per handoff request
+HANDOFF_MAX_BACKOFF = 60.0
+cluster_nodes = []
+shard_ring = ([], [])
+_cluster_config_mtime = None
+_handoff_retry_at = None  # Monotonic time of the next retry while a handoff is incomplete
+_handoff_backoff = 0.0
+_cluster_watch_pid = None
+_cluster_reload_lock = threading.Lock()
+
+# Optionally serve the frontend from /app/ with precompressed, fingerprinted assets
+SERVE_FRONTEND = os.environ.get('SERVE_FRONTEND', '0') == '1'
+FRONTEND_DIR = os.environ.get('FRONTEND_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public'))
+if SERVE_FRONTEND:
+    PRELOAD_MODULES += ['brotli']
+frontend_assets = {}
+
+# Request counts used to measure preflight overhead on the landmark endpoint
+traffic_counts = {'preflight': 0, 'framesJson': 0, 'framesSimple': 0, 'framesRing': 0}
+
+# Load reporting for /health and /ready. Each landmark request records
+# (finish time, processing ms, queue ms) into a bounded window; queue time comes
+# from the X-Request-Start header, which clients could forge, so it is only read
+# with TRUST_REQUEST_START=1, behind a proxy that always sets it (router.py
+# does). The saturation score is the largest ratio of a load signal to its
+# limit, and /ready fails once it reaches 1 so load balancers route away from
+# this worker.
+# Only sessions seen in the last HEALTH_ACTIVE_SECONDS count towards
+# HEALTH_MAX_SESSIONS.
+LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', '1000'))
+HEALTH_P99_LIMIT_MS = float(os.environ.get('HEALTH_P99_LIMIT_MS', '50'))
+HEALTH_QUEUE_LIMIT_MS = float(os.environ.get('HEALTH_QUEUE_LIMIT_MS', '100'))
+HEALTH_MAX_IN_FLIGHT = int(os.environ.get('HEALTH_MAX_IN_FLIGHT', '8'))
+HEALTH_MAX_SESSIONS = int(os.environ.get('HEALTH_MAX_SESSIONS', '5000'))
+HEALTH_ACTIVE_SECONDS = int(os.environ.get('HEALTH_ACTIVE_SECONDS', '60'))
+TRUST_REQUEST_START = os.environ.get('TRUST_REQUEST_START', '0') == '1'
+STATE_SIZE_SAMPLE = 50  # States measured to estimate state-store memory
+recent_requests = deque(maxlen=LATENCY_WINDOW)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+# Overload control: exponentially weighted averages of request queue time
+# (X-Request-Start, when trusted as above) and of the share of request threads
+# busy with other frames, and the process's CPU use over the last
+# OVERLOAD_CPU_INTERVAL, set a degradation level for every session. The thread
+# and CPU shares are measured here, so they work without a proxy; threads held
+# by open event streams don't count as capacity, and CPU is measured against
+# one core, which is all the GIL lets a worker's Python threads use.
+# Level 1 drops `angles` from responses; level 2 also advises clients to send
+# OVERLOAD_ADVISED_FPS frames per second (advisedFps, and X-Advised-FPS for push
+# responses); level 3 advises OVERLOAD_MIN_FPS and skips metric smoothing. Rep
+# counting is unaffected: the state machines count in frames and their
+# hysteresis and dwell still reject noise without smoothing. A level is entered
+# once the average reaches its threshold and left once it falls below
+# OVERLOAD_RECOVERY of it, so the level doesn't flap.
+OVERLOAD_CONTROL = os.environ.get('OVERLOAD_CONTROL', '1') == '1'
+OVERLOAD_QUEUE_MS = float(os.environ.get('OVERLOAD_QUEUE_MS', '50'))
+# A bogus X-Request-Start (0, a skewed clock, the wrong unit) could otherwise
+# hold the average up for thousands of requests
+MAX_QUEUE_SAMPLE_MS = 10 * OVERLOAD_QUEUE_MS
+OVERLOAD_BUSY_SHARE = 0.4  # Busy thread share weighing as much as OVERLOAD_QUEUE_MS
+OVERLOAD_CPU_SHARE = 0.9  # Share of a core weighing as much as OVERLOAD_QUEUE_MS
+OVERLOAD_CPU_INTERVAL = 0.5
+OVERLOAD_THRESHOLDS = (0.5, 1.0, 2.0)  # Multiples of OVERLOAD_QUEUE_MS entering levels 1-3
+OVERLOAD_RECOVERY = 0.7
+OVERLOAD_EWMA_ALPHA = 0.05
+OVERLOAD_ADVISED_FPS = float(os.environ.get('OVERLOAD_ADVISED_FPS', '15'))
+OVERLOAD_MIN_FPS = float(os.environ.get('OVERLOAD_MIN_FPS', '10'))
+OVERLOAD_SIGNAL_PARAMS = dict(DEFAULT_SIGNAL_PARAMS, alpha=1.0)
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', '8'))  # As in gunicorn.conf.py
+overload_queue_ms = 0.0
+overload_busy_share = 0.0
+overload_cpu_share = 0.0
+overload_level = 0
+_overload_cpu_mark = (time.monotonic(), time.process_time())
+
+# Frames for one session are counted one at a time, whichever thread or path
+# (HTTP, ring) they arrive on: a session's state machine and aggregates are
+# updated without locks of their own. Sessions hash onto a fixed set of locks,
+# so this costs no memory per session.
+SESSION_LOCK_STRIPES = 256
+_session_locks = [threading.Lock() for _ in range(SESSION_LOCK_STRIPES)]
+
+# Result push: frames posted with ?push=1 get an empty 204 instead of the full
+# result, and the session's rep, stage and form events are pushed over a
+# Server-Sent Events stream (GET /sessions/<id>/events). Each open stream holds
+# a worker thread for its whole life, so a worker accepts at most
+# SSE_MAX_STREAMS of them (default half of GUNICORN_THREADS), keeping the other
+# threads for frames; further streams get a 503 with Retry-After and the
+# browser falls back to reading results from its POSTs. Streams end after
+# SSE_MAX_SECONDS and EventSource reconnects, resuming from Last-Event-ID.
+# Event IDs are "<epoch>-<n>" with a random epoch per channel: a channel
+# recreated after a restart, handoff or prune numbers from 1 again, so an ID
+# from another epoch replays the whole buffer instead of hiding new events.
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+SSE_MAX_SECONDS = float(os.environ.get('SSE_MAX_SECONDS', '300'))
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', str(max(1, WORKER_THREADS // 2))))
+SSE_RETRY_AFTER = 30  # Seconds a refused stream waits; open streams last minutes
+_open_streams = 0
+SESSION_EVENT_BUFFER = 64  # Recent events kept per session for reconnects
+MAX_EVENT_CHANNELS = 10000
+session_events = {}
+_session_events_lock = threading.Lock()
+
+# Shared-memory ingestion for pose estimators running on the same host: each
+# name in LANDMARK_RINGS is a ring created by a local producer (see
+# landmark_ring.py). One thread per ring drains it into the same per-session
+# counting path as /process_landmarks; results reach clients through the
+# session's event stream. A lock file makes sure only one gunicorn worker
+# consumes each ring. In a cluster, frames for sessions another node owns are
+# counted as WRONG_SHARD and dropped: producers must write to the owner's ring.
+LANDMARK_RINGS = [name for name in os.environ.get('LANDMARK_RINGS', '').split(',') if name]
+RING_POLL_SECONDS = float(os.environ.get('RING_POLL_SECONDS', '0.001'))
+RING_RETRY_SECONDS = 1.0
+if LANDMARK_RINGS:
+    PRELOAD_MODULES += ['landmark_ring']
+_ring_consumer_pid = None
+_ring_consumer_lock = threading.Lock()
+
+@app.before_request
+def count_preflight():
+    """Count CORS preflights so their share of traffic can be measured"""
+    if request.method == 'OPTIONS':
+        traffic_counts['preflight'] += 1
+
+
+@app.before_request
+def admit_request():
+    """Shed over-limit landmark traffic before any JSON parsing"""
+    if request.method != 'POST' or request.path != '/process_landmarks':
+        return None
+
+    now = time.monotonic()
+    wait = take_token(ip_buckets, client_ip(), RATE_LIMIT_IP_RPS, RATE_LIMIT_IP_BURST, now)
+    if wait:
+        return reject_rate_limited('RATE_LIMITED_IP', wait)
+
+    session_id = request.args.get('sessionId')
+    if session_id is not None:
+        wait = take_token(session_buckets, session_id, RATE_LIMIT_SESSION_RPS, RATE_LIMIT_SESSION_BURST, now)
+        if wait:
+            return reject_rate_limited('RATE_LIMITED_SESSION', wait)
+    return None
+
+
 @app.route('/')
 def index():
     """Simple route for the root URL to verify the API is running"""
@@ -26,76 +430,1940 @@ def index():
         'status': 'online',
         'message': 'Exercise Counter API is running',
         'endpoints': {
-            '/process_landmarks': 'POST - Process exercise landmarks from MediaPipe'
+            '/process_landmarks': 'POST - Process exercise landmarks from MediaPipe',
+            '/sessions/<id>/metrics': 'GET - Per-rep tempo and range-of-motion metrics',
+            '/sessions/<id>/summary': 'GET - Workout summary for a session',
+            '/sessions/<id>/events': 'GET - Server-Sent Events stream of rep, stage and form events',
+            '/exercises': 'GET - Available exercise types',
+            '/shards': 'GET - Cluster nodes, or the node owning ?sessionId=',
+            '/health': 'GET - Load, latency and saturation report',
+            '/ready': 'GET - 200 when this worker can take more load, else 503',
+            '/app/': 'GET - Frontend (when SERVE_FRONTEND=1)',
+            '/debug/errors': 'GET - Error counts by code (admin)',
+            '/debug/traffic': 'GET - Preflight and frame request counts (admin)',
+            '/debug/costs': 'GET - CPU, allocation and state memory cost per exercise and session (admin)',
+            '/debug/profiles': 'GET - Recent request profiles (admin)'
         }
     })
 
 @app.route('/process_landmarks', methods=['POST'])
 def process_landmarks():
     """Process landmarks from the frontend and return exercise data"""
+    started = track_request_start()
+    profile = start_profile()
+    if SNAPSHOT_DIR and _snapshot_pid != os.getpid():
+        start_snapshotting()
+    if time.monotonic() - _exercise_config_checked > EXERCISE_RELOAD_INTERVAL:
+        reload_custom_exercises()
+    if time.monotonic() - _sessions_swept > SESSION_SWEEP_INTERVAL:
+        expire_idle_sessions()
+    if CLUSTER_CONFIG and _cluster_watch_pid != os.getpid():
+        start_cluster_watch()
     try:
-        data = request.json
+        # Validate the payload up front so malformed frames are rejected cheaply.
+        # Bodies sent as text/plain are parsed as JSON too: that content type
+        # makes the cross-origin POST a "simple" request with no preflight.
+        data = request.get_json(force=True, silent=True)
+        if not isinstance(data, dict):
+            return reject_payload('INVALID_JSON')
+        if request.mimetype == 'application/json':
+            traffic_counts['framesJson'] += 1
+        else:
+            traffic_counts['framesSimple'] += 1
         landmarks = data.get('landmarks', [])
         exercise_type = data.get('exerciseType', 'bicepCurl')
-        session_id = data.get('sessionId', request.remote_addr)  # Use provided session ID or fallback to IP
-        
+        query_session_id = request.args.get('sessionId')
+        # Use provided session ID or fall back to the query string, then the IP
+        session_id = data.get('sessionId', query_session_id if query_session_id is not None else request.remote_addr)
+        error_code, visible_mask = validate_payload(landmarks, exercise_type, session_id)
+        if error_code is not None:
+            return reject_payload(error_code)
+        if query_session_id is not None and query_session_id != session_id:
+            # The query value was rate limited before parsing: it must be the session counted
+            return reject_payload('SESSION_MISMATCH')
+        handler = exercise_handlers.get(exercise_type)
+        if handler is None:
+            # Removed by a config reload since validation
+            return reject_payload('UNKNOWN_EXERCISE')
+
+        # Frames for sessions owned by another node are sent back to the router
+        if cluster_nodes:
+            owner = sharding.ring_node(shard_ring, session_id)
+            if owner != NODE_URL:
+                return reject_wrong_shard(owner)
+
+        # Session rate limit for clients that only send sessionId in the body
+        if query_session_id is None:
+            wait = take_token(session_buckets, session_id, RATE_LIMIT_SESSION_RPS, RATE_LIMIT_SESSION_BURST, time.monotonic())
+            if wait:
+                return reject_rate_limited('RATE_LIMITED_SESSION', wait)
+        if profile is not None:
+            profile_mark(profile, 'parse')
+
+        # Sessions may have been flushed by another worker since this one restored
+        if SNAPSHOT_DIR:
+            catch_up_snapshot(session_id, f"{session_id}_{exercise_type}")
+
+        # Cap how fast one client can mint new sessions
+        if f"{session_id}_{exercise_type}" not in exercise_states and session_id not in session_summaries:
+            wait = take_token(new_session_buckets, client_ip(), NEW_SESSIONS_PER_MINUTE / 60,
+                              NEW_SESSIONS_PER_MINUTE, time.monotonic())
+            if wait:
+                return reject_rate_limited('TOO_MANY_SESSIONS', wait)
+
+        # Push clients only hear about changes, over the session's event stream
+        push = request.args.get('push') == '1'
+        level = overload_level
+        current_time = int(time.time() * 1000)  # Current time in milliseconds
+        result = count_frame(session_id, exercise_type, handler, landmarks, visible_mask, current_time,
+                             publish=push, profile=profile,
+                             signal_params=OVERLOAD_SIGNAL_PARAMS if level >= 3 else DEFAULT_SIGNAL_PARAMS)
+        if result is None:
+            return reject_payload('UNKNOWN_EXERCISE')
+        fps = advised_fps(level)
+        if push:
+            response = Response(status=204)
+        else:
+            if level >= 1:
+                # Lean response under load: angles are only for display
+                result = {key: value for key, value in result.items() if key != 'angles'}
+            if fps is not None:
+                result['advisedFps'] = fps
+            response = jsonify(result)
+            if profile is not None:
+                profile_mark(profile, 'serialization')
+        if fps is not None:
+            response.headers['X-Advised-FPS'] = f'{fps:g}'
+        return response
+    
+    except Exception as e:
+        log_error('INTERNAL_ERROR', f"Error processing landmarks: {e}")
+        return jsonify({'error': 'Internal error', 'code': 'INTERNAL_ERROR'}), 500
+
+    finally:
+        if profile is not None:
+            finish_profile(profile)
+        track_request_end(started)
+
+
+def count_frame(session_id, exercise_type, handler, landmarks, visible_mask, current_time, publish=False, profile=None,
+                signal_params=DEFAULT_SIGNAL_PARAMS):
+    """Run one validated frame through its session's counting state and return the result
+
+    Shared by /process_landmarks and the shared-memory ring consumer, so frames
+    from either path see the same per-session state, analytics and events.
+    Returns None, counting nothing, if a config reload removed the exercise
+    after its handler was looked up.
+    """
+    with _session_locks[hash(session_id) % SESSION_LOCK_STRIPES]:
+        if exercise_type not in EXERCISE_JOINT_GROUPS:
+            return None
+
         # Generate a unique client key combining session ID and exercise type
         client_key = f"{session_id}_{exercise_type}"
-        
+    
         # Initialize state for this client if not exists or if exercise type changed
         if client_key not in exercise_states:
             exercise_states[client_key] = {
                 'repCounter': 0,
                 'stage': 'down',
                 'lastRepTime': 0,
-                'holdStart': 0,
                 'leftArmStage': 'down',
                 'rightArmStage': 'down',
-                'leftArmHoldStart': 0,
-                'rightArmHoldStart': 0,
                 'exerciseType': exercise_type
             }
-        
+    
         client_state = exercise_states[client_key]
-        current_time = int(time.time() * 1000)  # Current time in milliseconds
-        rep_cooldown = 1000  # Prevent double counting
-        hold_threshold = 500  # Time to hold at position
-        
-        # Process landmarks based on exercise type
-        result = {
-            'repCounter': client_state['repCounter'],
-            'stage': client_state['stage'],
-            'feedback': ''
-        }
-        
-        # Process different exercise types
-        if exercise_type == 'bicepCurl':
-            result = process_bicep_curl(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        elif exercise_type == 'squat':
-            result = process_squat(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        elif exercise_type == 'pushup':
-            result = process_pushup(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        elif exercise_type == 'shoulderPress':
-            result = process_shoulder_press(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        elif exercise_type == 'tricepExtension':
-            result = process_tricep_extension(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        elif exercise_type == 'lunge':
-            result = process_lunge(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        elif exercise_type == 'calfRaises':  # Add this new condition
-            result = process_calf_raises(landmarks, client_state, current_time, rep_cooldown, hold_threshold)
-        
-        # Update client state with the new values
-        exercise_states[client_key] = client_state
-        
-        return jsonify(result)
+        rep_count_before = client_state['repCounter']
+        tracemalloc = None
+        if COST_ACCOUNTING:
+            cpu_start = time.thread_time()
+            tracemalloc = start_alloc_sample()
+        alloc = None
+        try:
+            if profile is not None:
+                profile['sessionId'] = session_id
+                profile['exerciseType'] = exercise_type
+                profile_mark(profile, 'stateLookup')
+                profile_enter_handler(profile)
     
-    except Exception as e:
-        print(f"Error processing landmarks: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+            # Process landmarks based on exercise type
+            result = {
+                'repCounter': client_state['repCounter'],
+                'stage': client_state['stage'],
+                'feedback': ''
+            }
+    
+            # Process different exercise types, skipping frames where the joints are occluded
+            if not frame_has_visible_group(visible_mask, exercise_type):
+                result['feedback'] = "Position not clear - adjust camera"
+                result['skipped'] = True
+            else:
+                result = handler(landmarks, client_state, current_time, signal_params, visible_mask)
+    
+            # Update client state with the new values
+            exercise_states[client_key] = client_state
+            if SNAPSHOT_DIR:
+                dirty_clients.add(client_key)
+                dirty_sessions.add(session_id)
+                if restored_at:
+                    # Now changed here: newer records from the log must not replace it
+                    restored_at.pop(('k', client_key), None)
+                    restored_at.pop(('u', session_id), None)
+    
+            # Update per-rep tempo and range-of-motion analytics
+            update_rep_metrics(client_state, exercise_type, result.get('angles'), rep_count_before, current_time)
+            update_session_summary(session_id, exercise_type, client_state['repCounter'] - rep_count_before, current_time, 'skipped' in result)
+            if profile is not None:
+                profile_exit_handler(profile)
+        finally:
+            # However the frame ends, a sampled trace must stop: left running it
+            # would trace every allocation in the worker and hold the sample lock
+            if tracemalloc is not None:
+                alloc = stop_alloc_sample(tracemalloc)
+        if COST_ACCOUNTING:
+            record_frame_cost(session_id, exercise_type, time.thread_time() - cpu_start, alloc)
+
+        if publish or session_id in session_events:
+            publish_frame_events(get_event_channel(session_id), exercise_type, result,
+                                 client_state['repCounter'] - rep_count_before)
+        return result
+
+
+@app.route('/app/', defaults={'filename': 'index.html'})
+@app.route('/app/<path:filename>')
+def frontend(filename):
+    """Serve a frontend asset, precompressed, with strong ETags"""
+    asset = frontend_assets.get(filename)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+
+    # Pick the smallest representation the client accepts (q=0 refuses it)
+    accept_encodings = request.accept_encodings
+    if asset['br'] is not None and accept_encodings['br'] > 0:
+        encoding = 'br'
+    elif accept_encodings['gzip'] > 0:
+        encoding = 'gzip'
+    else:
+        encoding = None
+    body, etag = asset[encoding] if encoding else asset['identity']
+
+    headers = {
+        'ETag': etag,
+        'Vary': 'Accept-Encoding',
+        # Fingerprinted names change with their content, so they never need revalidating
+        'Cache-Control': 'public, max-age=31536000, immutable' if filename == asset['fingerprinted']
+        else 'no-cache'
+    }
+    if request.if_none_match.contains_weak(etag.strip('"')):
+        return Response(status=304, headers=headers)
+
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, content_type=asset['contentType'], headers=headers)
+
+
+@app.route('/exercises')
+def list_exercises():
+    """List the built-in and config-defined exercise types"""
+    return jsonify({
+        'builtin': sorted(BUILTIN_HANDLERS),
+        'custom': sorted(custom_exercises)
+    })
+
+
+@app.route('/health')
+def health():
+    """Report live sessions, state memory, latency, queueing and saturation"""
+    return jsonify(health_report())
+
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 503 once this worker is saturated"""
+    report = health_report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+
+@app.route('/shards')
+def shards():
+    """Describe the cluster so clients and routers can find a session's node"""
+    if CLUSTER_CONFIG and _cluster_watch_pid != os.getpid():
+        start_cluster_watch()
+    result = {
+        'node': NODE_URL or None,
+        'nodes': cluster_nodes,
+        'vnodes': sharding.VNODES if CLUSTER_CONFIG else None
+    }
+    session_id = request.args.get('sessionId')
+    if session_id is not None:
+        result['owner'] = sharding.ring_node(shard_ring, session_id) if cluster_nodes else None
+    return jsonify(result)
+
+
+@app.route('/admin/handoff', methods=['POST'])
+def admin_handoff():
+    """Accept sessions handed off by a node that no longer owns them"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return reject_payload('INVALID_JSON')
+    accepted = accept_handoff(data.get('states', {}), data.get('summaries', {}))
+    return jsonify({'accepted': accepted})
+
+
+@app.route('/debug/errors')
+def debug_errors():
+    """Return error counts by code"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    return jsonify({'errors': error_counts})
+
+
+@app.route('/debug/traffic')
+def debug_traffic():
+    """Return landmark request counts and the share of requests that are preflights"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    frames = traffic_counts['framesJson'] + traffic_counts['framesSimple']
+    total = frames + traffic_counts['preflight']
+    return jsonify({
+        'counts': traffic_counts,
+        'preflightShare': traffic_counts['preflight'] / total if total else 0.0
+    })
+
+
+@app.route('/debug/costs')
+def debug_costs():
+    """Return CPU, allocation and state memory costs per exercise type and for the costliest sessions"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    return jsonify(cost_report(request.args.get('top', 20, type=int)))
+
+
+@app.route('/debug/profiles')
+def debug_profiles():
+    """Return the most recent request profiles"""
+    denied = require_admin()
+    if denied is not None:
+        return denied
+    return jsonify({'profiles': list(recent_profiles)})
+
+
+@app.route('/sessions/<session_id>/metrics')
+def session_metrics(session_id):
+    """Return per-rep tempo and range-of-motion metrics for a session"""
+    if SNAPSHOT_DIR:
+        catch_up_snapshot(session_id)
+    metrics = {}
+    # Copied: a config reload may add or remove exercises meanwhile
+    for exercise_type in list(REP_METRIC_SPECS):
+        client_state = exercise_states.get(f"{session_id}_{exercise_type}")
+        if client_state is not None and 'repMetrics' in client_state:
+            metrics[exercise_type] = rep_metrics_snapshot(client_state)
+
+    if not metrics:
+        return jsonify({'error': 'Unknown session'}), 404
+
+    return jsonify({'sessionId': session_id, 'exercises': metrics})
+
+
+@app.route('/sessions/<session_id>/summary')
+def session_summary(session_id):
+    """Return the workout summary for a session from its streaming aggregates"""
+    if SNAPSHOT_DIR:
+        catch_up_snapshot(session_id)
+    summary = session_summaries.get(session_id)
+    if summary is None:
+        return jsonify({'error': 'Unknown session'}), 404
+
+    # Per-rep stats come from the per-exercise accumulators, one per exercise performed
+    rep_stats = {}
+    for exercise_type in summary['repsByExercise']:
+        client_state = exercise_states.get(f"{session_id}_{exercise_type}")
+        if client_state is not None and 'repMetrics' in client_state:
+            rep_stats[exercise_type] = rep_metrics_snapshot(client_state)
+
+    return jsonify({
+        'sessionId': session_id,
+        'startedAt': summary['startedAt'],
+        'lastSeen': summary['lastSeen'],
+        'frames': summary['frames'],
+        'skippedFrames': summary['skippedFrames'],
+        'activeMs': summary['activeMs'],
+        'totalReps': summary['totalReps'],
+        'repsByExercise': summary['repsByExercise'],
+        'repStats': rep_stats
+    })
+
+
+@app.route('/sessions/<session_id>/events')
+def session_event_stream(session_id):
+    """Stream a session's rep, stage and form events as Server-Sent Events"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+
+    global _open_streams
+    with _session_events_lock:
+        admitted = _open_streams < SSE_MAX_STREAMS
+        if admitted:
+            _open_streams += 1
+    if not admitted:
+        error_counts['STREAMS_FULL'] = error_counts.get('STREAMS_FULL', 0) + 1
+        response = jsonify({'error': 'Too many event streams', 'code': 'STREAMS_FULL'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_RETRY_AFTER)
+        return response
+
+    response = Response(stream_events(get_event_channel(session_id), last_event_id),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the stream, even one that never started
+    response.call_on_close(release_stream)
+    return response
+
+
+def release_stream():
+    """Free an event stream's slot"""
+    global _open_streams
+    with _session_events_lock:
+        _open_streams -= 1
+
+
+def get_event_channel(session_id):
+    """Return the session's event channel, creating it on first use"""
+    channel = session_events.get(session_id)
+    if channel is not None:
+        return channel
+    with _session_events_lock:
+        channel = session_events.get(session_id)
+        if channel is None:
+            if len(session_events) >= MAX_EVENT_CHANNELS:
+                prune_event_channels()
+            channel = session_events[session_id] = {
+                'events': deque(maxlen=SESSION_EVENT_BUFFER),
+                'epoch': os.urandom(4).hex(),
+                'nextId': 1,
+                'condition': threading.Condition(),
+                'subscribers': 0,
+                'lastUsed': time.monotonic(),
+                'stage': None,
+                'feedback': None,
+                'warnings': []
+            }
+    return channel
+
+
+def prune_event_channels():
+    """Drop channels nobody has listened to or published on for a while (caller holds the lock)"""
+    oldest = time.monotonic() - SSE_MAX_SECONDS
+    for session_id, channel in list(session_events.items()):
+        if not channel['subscribers'] and channel['lastUsed'] < oldest:
+            del session_events[session_id]
+
+
+def publish_frame_events(channel, exercise_type, result, reps_added):
+    """Queue the events a frame produced and wake the session's streams"""
+    events = []
+    if reps_added:
+        events.append(('rep', {'repCounter': result['repCounter'], 'exerciseType': exercise_type}))
+    if result.get('stage') != channel['stage']:
+        channel['stage'] = result.get('stage')
+        events.append(('stage', {'stage': channel['stage'], 'exerciseType': exercise_type}))
+    feedback = result.get('feedback')
+    if feedback and feedback != channel['feedback']:
+        channel['feedback'] = feedback
+        events.append(('feedback', {'feedback': feedback}))
+    warnings = result.get('warnings') or []
+    if warnings != channel['warnings']:
+        channel['warnings'] = warnings
+        events.append(('warning', {'warnings': warnings}))
+    if not events:
+        return
+
+    with channel['condition']:
+        for name, data in events:
+            channel['events'].append((channel['nextId'], name, data))
+            channel['nextId'] += 1
+        channel['lastUsed'] = time.monotonic()
+        channel['condition'].notify_all()
+
+
+def stream_events(channel, last_event_id):
+    """Yield a channel's events in SSE format until the stream's time is up"""
+    with channel['condition']:
+        channel['subscribers'] += 1
+        # A new stream starts from now; a reconnect replays what it missed, and
+        # one that saw an earlier epoch of this channel replays everything kept
+        if last_event_id is None:
+            last_id = channel['nextId'] - 1
+        else:
+            epoch, _, number = last_event_id.partition('-')
+            last_id = int(number) if epoch == channel['epoch'] and number.isdigit() else 0
+            if last_id >= channel['nextId']:
+                last_id = 0
+    try:
+        yield 'retry: 1000\n\n'
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            with channel['condition']:
+                if channel['nextId'] - 1 <= last_id:
+                    channel['condition'].wait(min(SSE_KEEPALIVE_SECONDS, remaining))
+                pending = [event for event in channel['events'] if event[0] > last_id]
+            if not pending:
+                # Comment line: keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+                continue
+            for event_id, name, data in pending:
+                yield (f"id: {channel['epoch']}-{event_id}\nevent: {name}\n"
+                       f"data: {json.dumps(data, separators=(',', ':'))}\n\n")
+            last_id = pending[-1][0]
+    finally:
+        with channel['condition']:
+            channel['subscribers'] -= 1
+            channel['lastUsed'] = time.monotonic()
+
+
+def update_session_summary(session_id, exercise_type, reps_added, current_time, skipped=False):
+    """Fold the current frame into the session's streaming workout aggregates"""
+    summary = session_summaries.get(session_id)
+    if summary is None:
+        summary = session_summaries[session_id] = {
+            'startedAt': current_time,
+            'lastSeen': current_time,
+            'frames': 0,
+            'skippedFrames': 0,
+            'activeMs': 0,
+            'totalReps': 0,
+            'repsByExercise': {}
+        }
+
+    gap = current_time - summary['lastSeen']
+    if 0 < gap <= ACTIVE_GAP_MS:
+        summary['activeMs'] += gap
+    summary['lastSeen'] = current_time
+    summary['frames'] += 1
+    if skipped:
+        summary['skippedFrames'] += 1
+
+    reps_by_exercise = summary['repsByExercise']
+    reps_by_exercise[exercise_type] = reps_by_exercise.get(exercise_type, 0) + reps_added
+    summary['totalReps'] += reps_added
+
+
+def expire_idle_sessions():
+    """Drop sessions idle for longer than SESSION_TTL from every per-session store"""
+    global _sessions_swept
+    _sessions_swept = time.monotonic()
+    oldest = int(time.time() * 1000) - SESSION_TTL * 1000
+    for session_id, summary in list(session_summaries.items()):
+        if summary['lastSeen'] < oldest:
+            drop_session(session_id)
+
+
+def drop_session(session_id):
+    """Remove a session's summary, cost totals and per-exercise counting state"""
+    summary = session_summaries.pop(session_id, None)
+    restored_at.pop(('u', session_id), None)
+    session_costs.pop(session_id, None)
+    for exercise_type in summary['repsByExercise'] if summary else ():
+        client_key = f"{session_id}_{exercise_type}"
+        exercise_states.pop(client_key, None)
+        restored_at.pop(('k', client_key), None)
+
+
+def build_frontend_assets():
+    """Load the frontend, fingerprint it and build its gzip/brotli variants"""
+    try:
+        brotli = lazy_import('brotli')
+    except ImportError:
+        brotli = None
+
+    contents = {}
+    for filename in sorted(os.listdir(FRONTEND_DIR)):
+        path = os.path.join(FRONTEND_DIR, filename)
+        if os.path.isfile(path) and not filename.startswith('.'):
+            with open(path, 'rb') as f:
+                contents[filename] = f.read()
+
+    # Fingerprint everything except the entry page, then point the page at the new names
+    fingerprinted = {}
+    for filename, body in contents.items():
+        if filename != 'index.html':
+            root, ext = os.path.splitext(filename)
+            fingerprinted[filename] = f"{root}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+    if 'index.html' in contents:
+        page = contents['index.html']
+        for filename, name in fingerprinted.items():
+            page = page.replace(f'"{filename}"'.encode(), f'"{name}"'.encode())
+        # Served from this app, the frontend talks to the API on its own origin
+        page = re.sub(rb'(<meta name="backend-url" content=")[^"]*(")', rb'\1\2', page)
+        contents['index.html'] = page
+
+    assets = {}
+    for filename, body in contents.items():
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        asset = {
+            'fingerprinted': fingerprinted.get(filename),
+            'contentType': content_type,
+            'identity': (body, f'"{digest}"'),
+            'gzip': (gzip.compress(body, 9), f'"{digest}-gz"'),
+            'br': (brotli.compress(body, quality=11), f'"{digest}-br"') if brotli else None
+        }
+        assets[filename] = asset
+        if asset['fingerprinted']:
+            assets[asset['fingerprinted']] = asset
+
+    frontend_assets.clear()
+    frontend_assets.update(assets)
+
+
+def snapshot_paths():
+    """Return the snapshot log and lock file paths"""
+    return os.path.join(SNAPSHOT_DIR, 'sessions.log'), os.path.join(SNAPSHOT_DIR, 'sessions.lock')
+
+
+def start_snapshotting():
+    """Restore sessions from disk and start the snapshot thread in this process"""
+    global _snapshot_pid
+    with _snapshot_lock:
+        # Threads don't survive a fork, so each worker restores and snapshots for itself
+        if _snapshot_pid == os.getpid():
+            return
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        restore_snapshot()
+        threading.Thread(target=snapshot_loop, name='snapshot', daemon=True).start()
+        atexit.register(write_snapshot)
+        _snapshot_pid = os.getpid()
+
+
+def snapshot_loop():
+    """Periodically append changed sessions to the snapshot log"""
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        try:
+            write_snapshot()
+            restore_snapshot()
+        except OSError as e:
+            log_error('SNAPSHOT_ERROR', f"Error writing snapshot: {e}")
+
+
+def write_snapshot():
+    """Append every session changed since the last snapshot to the log"""
+
+    # Claim the dirty keys first: anything changed after this is picked up next time
+    keys = list(dirty_clients)
+    dirty_clients.difference_update(keys)
+    session_ids = list(dirty_sessions)
+    dirty_sessions.difference_update(session_ids)
+
+    now = int(time.time() * 1000)
+    lines = []
+    for records, dirty, key_name, store in ((keys, dirty_clients, 'k', exercise_states),
+                                            (session_ids, dirty_sessions, 'u', session_summaries)):
+        for key in records:
+            value = store.get(key)
+            if value is None:
+                continue
+            try:
+                lines.append(json.dumps({key_name: key, 't': now, 'v': value}, separators=(',', ':')))
+            except (RuntimeError, ValueError):
+                # Changed by a request thread mid-encode; retry on the next snapshot
+                dirty.add(key)
+    if not lines:
+        return
+
+    log_path, lock_path = snapshot_paths()
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(log_path, 'a') as log:
+            log.write('\n'.join(lines) + '\n')
+        if os.path.getsize(log_path) > SNAPSHOT_COMPACT_BYTES:
+            compact_snapshot(log_path)
+
+
+def read_snapshot(log, offset=0):
+    """Read the latest unexpired record per session from an open log, from an offset
+
+    Returns (records, offset just past the last complete line).
+    """
+    oldest = int(time.time() * 1000) - SNAPSHOT_TTL * 1000
+    latest = {}
+    log.seek(offset)
+    for line in log:
+        if not line.endswith(b'\n'):
+            # Torn final line from a crash mid-write
+            break
+        offset += len(line)
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record['t'] >= oldest:
+            latest[('k', record['k']) if 'k' in record else ('u', record['u'])] = record
+    return latest, offset
+
+
+def compact_snapshot(log_path):
+    """Rewrite the log with one record per live session (caller holds the lock)"""
+    with open(log_path, 'rb') as log:
+        latest = read_snapshot(log)[0]
+    tmp_path = log_path + '.tmp'
+    with open(tmp_path, 'w') as tmp:
+        for record in latest.values():
+            tmp.write(json.dumps(record, separators=(',', ':')) + '\n')
+    os.replace(tmp_path, log_path)
+
+
+def restore_snapshot():
+    """Load records appended to the snapshot log since the last call (all of them the first time)
+
+    Sessions this process doesn't hold are added; sessions it restored and hasn't
+    touched since are replaced by newer records.
+    """
+    global _snapshot_offset, _snapshot_inode
+    log_path, lock_path = snapshot_paths()
+    with _snapshot_read_lock:
+        try:
+            stat = os.stat(log_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino == _snapshot_inode and stat.st_size == _snapshot_offset:
+            return
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            with open(log_path, 'rb') as log:
+                # Compaction replaces the file: start over from the top
+                inode = os.fstat(log.fileno()).st_ino
+                offset = _snapshot_offset if inode == _snapshot_inode else 0
+                latest, _snapshot_offset = read_snapshot(log, offset)
+                _snapshot_inode = inode
+
+        for (kind, key), record in latest.items():
+            store = exercise_states if kind == 'k' else session_summaries
+            if key not in store or record['t'] > restored_at.get((kind, key), record['t']):
+                store[key] = record['v']
+                restored_at[(kind, key)] = record['t']
+
+
+def catch_up_snapshot(session_id, client_key=None):
+    """Read newer snapshot records before serving a session missing here or only restored"""
+    if (session_id not in session_summaries or ('u', session_id) in restored_at
+            or (client_key is not None and (client_key not in exercise_states or ('k', client_key) in restored_at))):
+        restore_snapshot()
+
+
+def start_cluster_watch():
+    """Start the thread that watches the cluster config in this process"""
+    global _cluster_watch_pid
+    with _cluster_reload_lock:
+        # Threads don't survive a fork, so each worker watches for itself
+        if _cluster_watch_pid == os.getpid():
+            return
+        threading.Thread(target=cluster_watch_loop, name='cluster-watch', daemon=True).start()
+        _cluster_watch_pid = os.getpid()
+
+
+def cluster_watch_loop():
+    """Periodically reload the cluster config and hand off sessions that moved"""
+    global _handoff_retry_at, _handoff_backoff
+    while True:
+        time.sleep(CLUSTER_RELOAD_INTERVAL)
+        try:
+            changed = reload_cluster_config()
+            retry = _handoff_retry_at is not None and time.monotonic() >= _handoff_retry_at
+            if not (changed or retry):
+                continue
+            if not session_summaries or hand_off_sessions():
+                _handoff_retry_at = None
+                _handoff_backoff = 0.0
+                continue
+        except Exception as e:
+            # Keep watching: a dead thread would never see another membership change
+            log_error('HANDOFF_ERROR', f"Error watching the cluster config: {e}")
+        _handoff_backoff = min(HANDOFF_MAX_BACKOFF, _handoff_backoff * 2 or CLUSTER_RELOAD_INTERVAL)
+        _handoff_retry_at = time.monotonic() + _handoff_backoff
+
+
+def reload_cluster_config():
+    """Reload the cluster membership; return True if it changed"""
+    global _cluster_config_mtime, cluster_nodes, shard_ring
+    with _cluster_reload_lock:
+        try:
+            mtime = os.stat(CLUSTER_CONFIG).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == _cluster_config_mtime:
+            return False
+        _cluster_config_mtime = mtime
+
+        nodes = []
+        if mtime is not None:
+            try:
+                nodes = sharding.load_cluster_nodes(CLUSTER_CONFIG)
+            except (OSError, ValueError, AttributeError) as e:
+                log_error('CONFIG_ERROR', f"Not reloading {CLUSTER_CONFIG}: {e}")
+                return False
+        if nodes and not NODE_URL:
+            log_error('CONFIG_ERROR', f"NODE_URL is not set; ignoring {CLUSTER_CONFIG}")
+            nodes = []
+        # A node missing from the list owns nothing: it drains all its sessions
+        shard_ring = sharding.build_ring(nodes)
+        cluster_nodes = nodes
+        return True
+
+
+def hand_off_sessions():
+    """Push sessions this node no longer owns to their new owners, then drop them
+
+    Returns True once every moved session has been handed off.
+    """
+    # Group moved sessions by their new owner. With an empty ring nobody owns
+    # anything and this node serves every session, so nothing moves
+    moved = {}
+    for session_id in list(session_summaries):
+        owner = sharding.ring_node(shard_ring, session_id)
+        if owner is not None and owner != NODE_URL:
+            moved.setdefault(owner, []).append(session_id)
+    client_keys = {}
+    for key, state in list(exercise_states.items()):
+        session_id = key[:-len(state['exerciseType']) - 1]
+        client_keys.setdefault(session_id, []).append(key)
+
+    if moved and not ADMIN_TOKEN:
+        log_error('HANDOFF_ERROR', "ADMIN_TOKEN is not set: set the same token on every node to hand sessions off")
+        return False
+
+    complete = True
+    for owner, session_ids in moved.items():
+        for i in range(0, len(session_ids), HANDOFF_BATCH):
+            batch = session_ids[i:i + HANDOFF_BATCH]
+            states = {key: exercise_states[key] for session_id in batch
+                      for key in client_keys.get(session_id, []) if key in exercise_states}
+            summaries = {session_id: session_summaries[session_id] for session_id in batch
+                         if session_id in session_summaries}
+            try:
+                handoff = urllib.request.Request(
+                    f"{owner}/admin/handoff",
+                    data=json.dumps({'states': states, 'summaries': summaries}, separators=(',', ':')).encode(),
+                    headers={'Content-Type': 'application/json', 'X-Admin-Token': ADMIN_TOKEN},
+                    method='POST')
+                with urllib.request.urlopen(handoff, timeout=10) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                # Keep the sessions; the watch thread retries with backoff
+                hint = ': is the same ADMIN_TOKEN set there?' if e.code in (403, 404) else ''
+                log_error('HANDOFF_ERROR', f"{owner} rejected a handoff with {e.code}{hint}")
+                complete = False
+                continue
+            except (OSError, ValueError) as e:
+                log_error('HANDOFF_ERROR', f"Error handing sessions off to {owner}: {e}")
+                complete = False
+                continue
+            for key in states:
+                exercise_states.pop(key, None)
+            for session_id in summaries:
+                session_summaries.pop(session_id, None)
+    return complete
+
+
+def accept_handoff(states, summaries):
+    """Merge handed-off sessions into this node's state; return how many were taken"""
+    client_keys = {}
+    for key, state in states.items():
+        client_keys.setdefault(key[:-len(state['exerciseType']) - 1], []).append(key)
+
+    accepted = 0
+    for session_id, summary in summaries.items():
+        local = session_summaries.get(session_id)
+        if local is None or local['startedAt'] == summary['startedAt']:
+            # New here, or two copies of the same history: the more recent one wins
+            if local is not None and local['lastSeen'] > summary['lastSeen']:
+                continue
+            session_summaries[session_id] = summary
+            for key in client_keys.get(session_id, []):
+                exercise_states[key] = states[key]
+        else:
+            # Frames that reached this node mid-handoff started a fresh copy:
+            # both counted different frames, so their counts add up
+            session_summaries[session_id] = merge_summaries(local, summary)
+            for key in client_keys.get(session_id, []):
+                local_state = exercise_states.get(key)
+                exercise_states[key] = states[key] if local_state is None else merge_states(
+                    local_state, states[key], local['lastSeen'] >= summary['lastSeen'])
+        if SNAPSHOT_DIR:
+            dirty_clients.update(client_keys.get(session_id, []))
+            dirty_sessions.add(session_id)
+        accepted += 1
+    return accepted
+
+
+def merge_summaries(a, b):
+    """Combine the summaries of two copies of a session that saw different frames"""
+    merged = dict(a if a['lastSeen'] >= b['lastSeen'] else b)
+    merged['startedAt'] = min(a['startedAt'], b['startedAt'])
+    merged['lastSeen'] = max(a['lastSeen'], b['lastSeen'])
+    for field in ('frames', 'skippedFrames', 'activeMs', 'totalReps'):
+        merged[field] = a[field] + b[field]
+    merged['repsByExercise'] = dict(a['repsByExercise'])
+    for exercise_type, reps in b['repsByExercise'].items():
+        merged['repsByExercise'][exercise_type] = merged['repsByExercise'].get(exercise_type, 0) + reps
+    return merged
+
+
+def merge_states(local, other, local_is_newer):
+    """Combine two copies of an exercise state that counted different frames
+
+    The newer copy keeps its state machine; rep counts and rep metrics add up.
+    """
+    newer, older = (local, other) if local_is_newer else (other, local)
+    newer['repCounter'] += older['repCounter']
+    newer_metrics = newer.get('repMetrics')
+    older_metrics = older.get('repMetrics')
+    if newer_metrics is None:
+        if older_metrics is not None:
+            newer['repMetrics'] = older_metrics
+    elif older_metrics is not None:
+        for name in ('concentricMs', 'eccentricMs', 'minAngle', 'maxAngle', 'rangeOfMotion', 'asymmetry'):
+            merge_running_stat(newer_metrics[name], older_metrics[name])
+        if newer_metrics['lastRep'] is None:
+            newer_metrics['lastRep'] = older_metrics['lastRep']
+    return newer
+
+
+def reject_wrong_shard(owner):
+    """Tell the router which node owns this session"""
+    error_counts['WRONG_SHARD'] = error_counts.get('WRONG_SHARD', 0) + 1
+    response = jsonify({'error': 'Session belongs to another node', 'code': 'WRONG_SHARD', 'node': owner})
+    response.status_code = 421
+    response.headers['X-Shard-Node'] = owner
+    return response
+
+
+def start_ring_consumers():
+    """Start one consumer thread per landmark ring in this process"""
+    global _ring_consumer_pid
+    with _ring_consumer_lock:
+        if _ring_consumer_pid == os.getpid():
+            return
+        for name in LANDMARK_RINGS:
+            threading.Thread(target=ring_consumer_loop, args=(name,), name=f'ring-{name}', daemon=True).start()
+        _ring_consumer_pid = os.getpid()
+
+
+def ring_consumer_loop(name):
+    """Claim a ring, wait for its producer and count every frame written to it"""
+    lock_path = os.path.join(tempfile.gettempdir(), f'landmark_ring_{name}.lock')
+    lock_file = open(lock_path, 'a')
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except OSError:
+            # Another worker consumes this ring; take over if it exits
+            time.sleep(RING_RETRY_SECONDS * 5)
+
+    ring = None
+    while ring is None:
+        try:
+            ring = lazy_import('landmark_ring').LandmarkRing.attach(name)
+        except (OSError, ValueError):
+            time.sleep(RING_RETRY_SECONDS)
+    if SNAPSHOT_DIR:
+        start_snapshotting()
+
+    while True:
+        if drain_ring(ring):
+            continue
+        if time.monotonic() - _exercise_config_checked > EXERCISE_RELOAD_INTERVAL:
+            reload_custom_exercises()
+        if time.monotonic() - _sessions_swept > SESSION_SWEEP_INTERVAL:
+            expire_idle_sessions()
+        time.sleep(RING_POLL_SECONDS)
+
+
+def drain_ring(ring):
+    """Count every frame waiting in a ring; return how many slots were consumed"""
+    consumed = 0
+    while True:
+        try:
+            frame = ring.read()
+        except ValueError as e:
+            log_error('RING_ERROR', f"Error reading landmark ring: {e}")
+            ring.release()
+            consumed += 1
+            continue
+        if frame is None:
+            return consumed
+        session_id, exercise_type, timestamp_ms, values = frame
+        with values:
+            floats = values.tolist()
+        ring.release()
+        consumed += 1
+        try:
+            consume_ring_frame(session_id, exercise_type, timestamp_ms, floats)
+        except Exception as e:
+            log_error('RING_ERROR', f"Error counting ring frame: {e}")
+
+
+def consume_ring_frame(session_id, exercise_type, timestamp_ms, floats):
+    """Count one frame read from a landmark ring"""
+    traffic_counts['framesRing'] += 1
+    handler = exercise_handlers.get(exercise_type)
+    if handler is None:
+        error_counts['UNKNOWN_EXERCISE'] = error_counts.get('UNKNOWN_EXERCISE', 0) + 1
+        return
+    # NaN and infinity never pass the JSON path's validation; reject them here too
+    if not math.isfinite(sum(floats)):
+        error_counts['INVALID_PAYLOAD'] = error_counts.get('INVALID_PAYLOAD', 0) + 1
+        return
+    # Counting a session another node owns would split its state in two
+    if cluster_nodes and sharding.ring_node(shard_ring, session_id) != NODE_URL:
+        error_counts['WRONG_SHARD'] = error_counts.get('WRONG_SHARD', 0) + 1
+        return
+    if SNAPSHOT_DIR:
+        catch_up_snapshot(session_id, f"{session_id}_{exercise_type}")
+
+    landmarks = []
+    visible_mask = 0
+    bit = 1
+    for i in range(0, len(floats), 4):
+        visibility = floats[i + 3]
+        landmarks.append({'x': floats[i], 'y': floats[i + 1], 'z': floats[i + 2], 'visibility': visibility})
+        if visibility >= VISIBILITY_THRESHOLD:
+            visible_mask |= bit
+        bit <<= 1
+    if count_frame(session_id, exercise_type, handler, landmarks, visible_mask,
+                   timestamp_ms or int(time.time() * 1000)) is None:
+        error_counts['UNKNOWN_EXERCISE'] = error_counts.get('UNKNOWN_EXERCISE', 0) + 1
+
+
+def new_running_stat():
+    """Create an empty running min/max/mean accumulator"""
+    return {'count': 0, 'mean': 0.0, 'min': None, 'max': None}
+
+
+def merge_running_stat(stat, other):
+    """Fold another running accumulator into this one"""
+    if not other['count']:
+        return
+    count = stat['count'] + other['count']
+    stat['mean'] = (stat['mean'] * stat['count'] + other['mean'] * other['count']) / count
+    stat['count'] = count
+    if other['min'] is not None and (stat['min'] is None or other['min'] < stat['min']):
+        stat['min'] = other['min']
+    if other['max'] is not None and (stat['max'] is None or other['max'] > stat['max']):
+        stat['max'] = other['max']
+
+
+def update_running_stat(stat, value):
+    """Fold a value into a running accumulator in O(1)"""
+    stat['count'] += 1
+    stat['mean'] += (value - stat['mean']) / stat['count']
+    if stat['min'] is None or value < stat['min']:
+        stat['min'] = value
+    if stat['max'] is None or value > stat['max']:
+        stat['max'] = value
+
+
+def new_rep_window(current_time):
+    """Create the accumulators for the rep currently in progress"""
+    return {
+        'start': current_time,
+        'min': None,
+        'minTime': None,
+        'max': None,
+        'maxTime': None,
+        'asymmetry': new_running_stat()
+    }
+
+
+def update_rep_metrics(state, exercise_type, angles, rep_count_before, current_time):
+    """Incrementally update per-rep metrics from the angles of the current frame"""
+    spec = REP_METRIC_SPECS.get(exercise_type)
+    if spec is None or not angles:
+        return
+    left_key, right_key, count_at, concentric_to_count = spec
+
+    metrics = state.get('repMetrics')
+    if metrics is None:
+        metrics = state['repMetrics'] = {
+            'current': new_rep_window(current_time),
+            'lastRep': None,
+            'concentricMs': new_running_stat(),
+            'eccentricMs': new_running_stat(),
+            'minAngle': new_running_stat(),
+            'maxAngle': new_running_stat(),
+            'rangeOfMotion': new_running_stat(),
+            'asymmetry': new_running_stat()
+        }
+
+    left = angles.get(left_key)
+    right = angles.get(right_key)
+    left_value = left['value'] if left else None
+    right_value = right['value'] if right else None
+
+    # Combine both sides into one metric value for this frame
+    if left_value is not None and right_value is not None:
+        value = (left_value + right_value) / 2
+    elif left_value is not None:
+        value = left_value
+    elif right_value is not None:
+        value = right_value
+    else:
+        value = None
+
+    current = metrics['current']
+    if value is not None:
+        if current['min'] is None or value < current['min']:
+            current['min'] = value
+            current['minTime'] = current_time
+        if current['max'] is None or value > current['max']:
+            current['max'] = value
+            current['maxTime'] = current_time
+        if left_value is not None and right_value is not None:
+            update_running_stat(current['asymmetry'], abs(left_value - right_value))
+
+    if state['repCounter'] <= rep_count_before or current['min'] is None:
+        return
+
+    # A rep was just counted: the opposite extreme splits the rep into its two phases
+    turn_time = current['maxTime'] if count_at == 'min' else current['minTime']
+    to_turn_ms = turn_time - current['start']
+    to_count_ms = current_time - turn_time
+    if concentric_to_count:
+        concentric_ms, eccentric_ms = to_count_ms, to_turn_ms
+    else:
+        concentric_ms, eccentric_ms = to_turn_ms, to_count_ms
+
+    last_rep = {
+        'concentricMs': concentric_ms,
+        'eccentricMs': eccentric_ms,
+        'minAngle': current['min'],
+        'maxAngle': current['max'],
+        'rangeOfMotion': current['max'] - current['min'],
+        'asymmetry': current['asymmetry']['mean'] if current['asymmetry']['count'] else None
+    }
+    for key, rep_value in last_rep.items():
+        if rep_value is not None:
+            update_running_stat(metrics[key], rep_value)
+    metrics['lastRep'] = last_rep
+
+    # Start the next rep from the extreme where this one was counted
+    metrics['current'] = new_rep_window(current_time)
+    if value is not None:
+        metrics['current']['min'] = metrics['current']['max'] = value
+        metrics['current']['minTime'] = metrics['current']['maxTime'] = current_time
+
+
+def rep_metrics_snapshot(state):
+    """Build the public view of a session's rep metrics"""
+    metrics = state['repMetrics']
+    return {
+        'repCounter': state['repCounter'],
+        'lastRep': metrics['lastRep'],
+        'concentricMs': metrics['concentricMs'],
+        'eccentricMs': metrics['eccentricMs'],
+        'minAngle': metrics['minAngle'],
+        'maxAngle': metrics['maxAngle'],
+        'rangeOfMotion': metrics['rangeOfMotion'],
+        'asymmetry': metrics['asymmetry']
+    }
+
+
+def validate_payload(landmarks, exercise_type, session_id):
+    """Validate the landmark payload and build its visibility mask in one pass
+
+    Returns (error_code, visible_mask); error_code is None for a valid payload.
+    Landmarks without a visibility field count as visible.
+    """
+    if exercise_type not in exercise_handlers:
+        return 'UNKNOWN_EXERCISE', 0
+    if not isinstance(session_id, str) or len(session_id) > MAX_SESSION_ID_LENGTH:
+        return 'INVALID_SESSION', 0
+    if not isinstance(landmarks, list):
+        return 'LANDMARKS_NOT_LIST', 0
+    if len(landmarks) != LANDMARK_COUNT:
+        return 'LANDMARKS_LENGTH', 0
+
+    visible_mask = 0
+    bit = 1
+    # Sum of every value: NaN or infinity anywhere makes it non-finite
+    total = 0.0
+    try:
+        for point in landmarks:
+            if type(point) is not dict:
+                return 'LANDMARK_NOT_OBJECT', 0
+            # Exact type checks: bool is an int subclass and must not pass
+            x = point.get('x')
+            y = point.get('y')
+            if type(x) not in (float, int) or type(y) not in (float, int):
+                return 'LANDMARK_NOT_NUMERIC', 0
+            total += x + y
+            z = point.get('z')
+            if z is not None:
+                if type(z) not in (float, int):
+                    return 'LANDMARK_NOT_NUMERIC', 0
+                total += z
+            visibility = point.get('visibility')
+            if visibility is None:
+                visible_mask |= bit
+            elif type(visibility) not in (float, int):
+                return 'LANDMARK_NOT_NUMERIC', 0
+            else:
+                total += visibility
+                if visibility >= VISIBILITY_THRESHOLD:
+                    visible_mask |= bit
+            bit <<= 1
+    except OverflowError:
+        # An integer too large to convert to a float
+        return 'INVALID_PAYLOAD', 0
+    # Non-finite values would poison the smoothing state and can't be sent back as JSON
+    if not math.isfinite(total):
+        return 'INVALID_PAYLOAD', 0
+    return None, visible_mask
+
+
+def is_visible(visible_mask, group):
+    """Check that every landmark in a joint group is visible"""
+    return visible_mask & group == group
+
+
+def frame_has_visible_group(visible_mask, exercise_type):
+    """Check whether any joint group the exercise relies on is fully visible
+
+    An exercise a config reload has just removed has no groups, so none are visible.
+    """
+    for group in EXERCISE_JOINT_GROUPS.get(exercise_type, ()):
+        if visible_mask & group == group:
+            return True
+    return False
+
+
+def reject_payload(code):
+    """Count a rejected payload and return its error response"""
+    error_counts[code] = error_counts.get(code, 0) + 1
+    return jsonify({'error': PAYLOAD_ERRORS[code], 'code': code}), 400
+
+
+def log_error(code, message):
+    """Count an error and log it asynchronously, rate limited per error code"""
+    global _log_listener_pid
+    error_counts[code] = error_counts.get(code, 0) + 1
+
+    # Token bucket per code: refill at LOG_RATE_PER_SEC up to LOG_BURST
+    now = time.monotonic()
+    bucket = _log_buckets.get(code)
+    if bucket is None:
+        bucket = _log_buckets[code] = {'tokens': LOG_BURST, 'updated': now, 'suppressed': 0}
+    bucket['tokens'] = min(LOG_BURST, bucket['tokens'] + (now - bucket['updated']) * LOG_RATE_PER_SEC)
+    bucket['updated'] = now
+    if bucket['tokens'] < 1:
+        bucket['suppressed'] += 1
+        return
+    bucket['tokens'] -= 1
+
+    # The listener thread does not survive a fork, so start one per process
+    if _log_listener_pid != os.getpid():
+        _log_listener_pid = os.getpid()
+        logging.handlers.QueueListener(_log_queue, logging.StreamHandler()).start()
+
+    suppressed = bucket['suppressed']
+    bucket['suppressed'] = 0
+    logger.warning("code=%s suppressed=%d message=%s", code, suppressed, message)
+
+
+def compile_exercise(name, spec):
+    """Validate a custom exercise definition and compile it into a handler
+
+    Returns (handler, joint groups, rep metric spec); raises ValueError if the
+    definition is invalid.
+    """
+    if name in BUILTIN_HANDLERS:
+        raise ValueError(f"{name}: name clashes with a built-in exercise")
+    if not isinstance(spec, dict):
+        raise ValueError(f"{name}: definition must be an object")
+
+    metric = spec.get('metric')
+    if metric not in ('angle', 'height'):
+        raise ValueError(f"{name}: metric must be 'angle' or 'height'")
+    joint_count = 3 if metric == 'angle' else 2
+
+    joints = spec.get('joints')
+    if not isinstance(joints, dict) or not (joints.get('left') or joints.get('right')):
+        raise ValueError(f"{name}: joints must define 'left' and/or 'right'")
+    sides = []
+    for side, key in (('left', 'L'), ('right', 'R')):
+        indices = joints.get(side)
+        if indices is None:
+            continue
+        if (not isinstance(indices, list) or len(indices) != joint_count or
+                not all(type(i) is int and 0 <= i < LANDMARK_COUNT for i in indices)):
+            raise ValueError(f"{name}: {side} joints must be {joint_count} landmark indices")
+        sides.append((key, tuple(indices), joint_mask(*indices)))
+
+    threshold = spec.get('threshold')
+    hysteresis = spec.get('hysteresis', 0)
+    if type(threshold) not in (int, float) or type(hysteresis) not in (int, float) or hysteresis < 0:
+        raise ValueError(f"{name}: threshold must be a number and hysteresis a non-negative number")
+
+    count_on = spec.get('countOn', 'up')
+    if count_on not in ('up', 'down'):
+        raise ValueError(f"{name}: countOn must be 'up' or 'down'")
+    reset_on = 'down' if count_on == 'up' else 'up'
+
+    combine = spec.get('combine', 'avg')
+    if combine not in ('avg', 'min', 'max'):
+        raise ValueError(f"{name}: combine must be 'avg', 'min' or 'max'")
+
+    # Frames a new position must persist before it counts; defaults to MIN_DWELL_FRAMES
+    min_dwell = spec.get('minDwellFrames')
+    if min_dwell is not None and (type(min_dwell) is not int or min_dwell < 1):
+        raise ValueError(f"{name}: minDwellFrames must be a positive integer")
+
+    # The hysteresis band is centred on the threshold
+    up_level = threshold + hysteresis / 2
+    down_level = threshold - hysteresis / 2
+    label_index = 1 if metric == 'angle' else 0
+
+    def handler(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
+        """Process landmarks for a config-defined exercise"""
+        try:
+            angles = {}
+            values = []
+            for key, indices, group in sides:
+                if not is_visible(visible_mask, group):
+                    continue
+                if metric == 'angle':
+                    value = calculate_angle(landmarks[indices[0]], landmarks[indices[1]], landmarks[indices[2]])
+                else:
+                    value = (landmarks[indices[1]]['y'] - landmarks[indices[0]]['y']) * 100
+                label_point = landmarks[indices[label_index]]
+                angles[key] = {
+                    'value': value,
+                    'position': {
+                        'x': label_point['x'],
+                        'y': label_point['y']
+                    }
+                }
+                values.append(value)
+
+            if combine == 'avg':
+                value = sum(values) / len(values)
+            elif combine == 'min':
+                value = min(values)
+            else:
+                value = max(values)
+
+            feedback = ""
+            params = signal_params if min_dwell is None else dict(signal_params, minDwell=min_dwell)
+            event = signal_update(get_signal(state, 'metric'), value, down_level, up_level, params)
+            event = {'low': 'down', 'high': 'up'}.get(event)
+            if event == reset_on:
+                state['stage'] = reset_on
+            elif event == count_on and state['stage'] == reset_on:
+                state['stage'] = count_on
+                state['repCounter'] += 1
+                state['lastRepTime'] = current_time
+                feedback = "Rep complete!"
+
+            return {
+                'repCounter': state['repCounter'],
+                'stage': state['stage'],
+                'feedback': feedback,
+                'angles': angles
+            }
+
+        except Exception as e:
+            log_error('HANDLER_ERROR', f"Error in {name} detection: {e}")
+            return {
+                'repCounter': state['repCounter'],
+                'stage': state['stage'],
+                'feedback': '',
+                'errorCode': 'HANDLER_ERROR',
+                'angles': {}
+            }
+
+    groups = tuple(group for _, _, group in sides)
+    rep_spec = ('L', 'R', 'max' if count_on == 'up' else 'min', count_on == 'up')
+    return handler, groups, rep_spec
+
+
+def reload_custom_exercises():
+    """Reload the exercise config if it changed, keeping the old set on errors"""
+    global _exercise_config_mtime, _exercise_config_checked
+    # Only one thread reloads; the others keep using the current handlers
+    if not _exercise_reload_lock.acquire(blocking=False):
+        return
+    try:
+        _exercise_config_checked = time.monotonic()
+        try:
+            mtime = os.stat(EXERCISE_CONFIG).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == _exercise_config_mtime:
+            return
+        _exercise_config_mtime = mtime
+
+        compiled = {}
+        if mtime is not None:
+            try:
+                with open(EXERCISE_CONFIG) as f:
+                    config = json.load(f)
+                for name, spec in config.get('exercises', {}).items():
+                    compiled[name] = compile_exercise(name, spec)
+            except (OSError, ValueError, AttributeError) as e:
+                log_error('CONFIG_ERROR', f"Not reloading {EXERCISE_CONFIG}: {e}")
+                return
+
+        # Swap entries in an order that never exposes a handler without its
+        # metadata; sessions keep their state dicts across the swap. Removal
+        # can still race a frame whose handler was looked up just before, so
+        # readers of the metadata treat a missing exercise as unknown
+        for name, (handler, groups, rep_spec) in compiled.items():
+            EXERCISE_JOINT_GROUPS[name] = groups
+            REP_METRIC_SPECS[name] = rep_spec
+            exercise_handlers[name] = handler
+        for name in list(custom_exercises):
+            if name not in compiled:
+                exercise_handlers.pop(name, None)
+                EXERCISE_JOINT_GROUPS.pop(name, None)
+                REP_METRIC_SPECS.pop(name, None)
+        custom_exercises.clear()
+        custom_exercises.update(compiled)
+    finally:
+        _exercise_reload_lock.release()
+
+
+def client_ip():
+    """Return the client's IP, honouring X-Forwarded-For behind trusted proxies"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get('X-Forwarded-For')
+        if forwarded:
+            # Each proxy appends the address it saw, so entries left of the ones our
+            # proxies added are whatever the client sent: take the outermost proxy's
+            entries = forwarded.split(',')
+            return entries[max(0, len(entries) - TRUST_PROXY_HEADERS)].strip()
+    return request.remote_addr
+
+
+def take_token(buckets, key, rate, burst, now):
+    """Take a token from a bucket; return 0 if allowed, else seconds until one is available"""
+    # Buckets are [tokens, last update] lists to keep per-client memory small
+    bucket = buckets.get(key)
+    if bucket is None:
+        if len(buckets) >= RATE_LIMIT_MAX_BUCKETS:
+            prune_buckets(buckets, rate, burst, now)
+        buckets[key] = [burst - 1, now]
+        return 0
+
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens >= 1:
+        bucket[0] = tokens - 1
+        return 0
+    bucket[0] = tokens
+    return (1 - tokens) / rate
+
+
+def prune_buckets(buckets, rate, burst, now):
+    """Drop buckets that have refilled completely, i.e. clients that went quiet"""
+    for key, bucket in list(buckets.items()):
+        if bucket[0] + (now - bucket[1]) * rate >= burst:
+            del buckets[key]
+
+
+def reject_rate_limited(code, wait):
+    """Count a shed request and return a 429 telling the client when to retry"""
+    error_counts[code] = error_counts.get(code, 0) + 1
+    response = jsonify({'error': 'Too many requests', 'code': code})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def require_admin():
+    """Return an error response unless the request carries the admin token"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not admin_token_valid(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
+
+
+def admin_token_valid(token):
+    """Compare a presented token with ADMIN_TOKEN in constant time"""
+    if not ADMIN_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def track_request_start():
+    """Count a landmark request as in flight and return its start time"""
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    return time.perf_counter()
+
+
+def track_request_end(started):
+    """Record a finished landmark request's processing and queue time"""
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+        others = _in_flight
+    queue_ms = request_queue_ms()
+    recent_requests.append((time.monotonic(), (time.perf_counter() - started) * 1000, queue_ms))
+    if OVERLOAD_CONTROL:
+        update_overload_level(queue_ms, others)
+
+
+def update_overload_level(queue_ms, busy_threads):
+    """Fold a request's queue time and the other requests in flight into the averages
+    and move the degradation level"""
+    global overload_queue_ms, overload_busy_share, overload_cpu_share, overload_level, _overload_cpu_mark
+    overload_queue_ms += OVERLOAD_EWMA_ALPHA * (queue_ms - overload_queue_ms)
+    busy_share = busy_threads / max(1, WORKER_THREADS - _open_streams)
+    overload_busy_share += OVERLOAD_EWMA_ALPHA * (busy_share - overload_busy_share)
+    now = time.monotonic()
+    if now - _overload_cpu_mark[0] >= OVERLOAD_CPU_INTERVAL:
+        cpu = time.process_time()
+        overload_cpu_share = (cpu - _overload_cpu_mark[1]) / (now - _overload_cpu_mark[0])
+        _overload_cpu_mark = (now, cpu)
+    pressure = max(overload_queue_ms / OVERLOAD_QUEUE_MS, overload_busy_share / OVERLOAD_BUSY_SHARE,
+                   overload_cpu_share / OVERLOAD_CPU_SHARE)
+    level = overload_level
+    while level < len(OVERLOAD_THRESHOLDS) and pressure >= OVERLOAD_THRESHOLDS[level]:
+        level += 1
+    while level > 0 and pressure < OVERLOAD_THRESHOLDS[level - 1] * OVERLOAD_RECOVERY:
+        level -= 1
+    overload_level = level
+
+
+def advised_fps(level):
+    """Return the frame rate clients are asked to drop to at a degradation level, or None"""
+    if level >= 3:
+        return OVERLOAD_MIN_FPS
+    if level >= 2:
+        return OVERLOAD_ADVISED_FPS
+    return None
+
+
+def request_queue_ms():
+    """Return how long the request waited before reaching the app, from a trusted X-Request-Start"""
+    header = request.environ.get('HTTP_X_REQUEST_START') if TRUST_REQUEST_START else None
+    if not header:
+        return 0.0
+    try:
+        value = float(header[2:] if header.startswith('t=') else header)
+    except ValueError:
+        return 0.0
+    # Proxies send seconds, milliseconds or microseconds since the epoch
+    if value > 1e14:
+        value /= 1e6
+    elif value > 1e11:
+        value /= 1e3
+    queue_ms = (time.time() - value) * 1000
+    # A start in the future says nothing about queueing
+    if queue_ms < 0:
+        return 0.0
+    return min(queue_ms, MAX_QUEUE_SAMPLE_MS)
+
+
+def percentile(values, fraction):
+    """Return the given percentile of a list of numbers (nearest rank)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def deep_sizeof(value):
+    """Approximate the memory used by a JSON-like value, in bytes"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, deque)):
+        size += sum(deep_sizeof(v) for v in value)
+    return size
+
+
+def estimate_state_bytes():
+    """Estimate the memory held by session state from a sample of states"""
+    count = len(exercise_states)
+    if not count:
+        return 0
+    sample = list(itertools.islice(exercise_states.values(), STATE_SIZE_SAMPLE))
+    return int(sum(deep_sizeof(state) for state in sample) / len(sample) * count)
+
+
+def health_report():
+    """Build the load report shared by /health and /ready"""
+    now = time.monotonic()
+    window = list(recent_requests)
+    latencies = [entry[1] for entry in window]
+    queue_times = [entry[2] for entry in window]
+
+    # Little's law: requests waiting ~= arrival rate x mean queue time
+    span = now - window[0][0] if window else 0
+    rate = len(window) / span if span > 0 else 0.0
+    mean_queue_ms = sum(queue_times) / len(queue_times) if queue_times else 0.0
+    p99_ms = percentile(latencies, 0.99)
+    queue_p99_ms = percentile(queue_times, 0.99)
+
+    active_since = int(time.time() * 1000) - HEALTH_ACTIVE_SECONDS * 1000
+    active_sessions = sum(1 for summary in list(session_summaries.values()) if summary['lastSeen'] >= active_since)
+    pressures = {
+        'latency': p99_ms / HEALTH_P99_LIMIT_MS,
+        'queue': queue_p99_ms / HEALTH_QUEUE_LIMIT_MS,
+        'inFlight': _in_flight / HEALTH_MAX_IN_FLIGHT,
+        'sessions': active_sessions / HEALTH_MAX_SESSIONS
+    }
+    saturation = max(pressures.values())
+    return {
+        'status': 'online',
+        'ready': saturation < 1,
+        'pid': os.getpid(),
+        'sessions': len(session_summaries),
+        'activeSessions': active_sessions,
+        'clientStates': len(exercise_states),
+        'stateBytes': estimate_state_bytes(),
+        'requestsPerSec': rate,
+        'latencyMs': {
+            'p50': percentile(latencies, 0.5),
+            'p99': p99_ms
+        },
+        'queueMs': {
+            'mean': mean_queue_ms,
+            'p99': queue_p99_ms
+        },
+        'inFlight': _in_flight,
+        'openStreams': _open_streams,
+        'queueDepth': rate * mean_queue_ms / 1000,
+        'saturation': saturation,
+        'pressures': pressures,
+        'overload': {
+            'level': overload_level,
+            'queueMsAverage': overload_queue_ms,
+            'busyShareAverage': overload_busy_share,
+            'cpuShare': overload_cpu_share,
+            'advisedFps': advised_fps(overload_level)
+        }
+    }
+
+
+def start_alloc_sample():
+    """Start tracing allocations for a sampled frame; return tracemalloc, or None if not sampled"""
+    if not COST_ALLOC_SAMPLE_RATE or random.random() >= COST_ALLOC_SAMPLE_RATE:
+        return None
+    # Another request's allocations would be counted as this frame's
+    if _in_flight > 1:
+        return None
+    # Tracing is process wide: one sample at a time, and never over someone else's trace
+    if not _alloc_sample_lock.acquire(blocking=False):
+        return None
+    if tracemalloc.is_tracing():
+        _alloc_sample_lock.release()
+        return None
+    tracemalloc.start()
+    return tracemalloc
+
+
+def stop_alloc_sample(tracemalloc):
+    """Stop a sampled trace; return (bytes still allocated, peak bytes) since it started"""
+    try:
+        return tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        _alloc_sample_lock.release()
+
+
+def record_frame_cost(session_id, exercise_type, cpu_seconds, alloc=None):
+    """Add one frame's CPU time (and sampled allocations) to its exercise and session totals"""
+    cost = exercise_costs.get(exercise_type)
+    if cost is None:
+        cost = exercise_costs[exercise_type] = {
+            'frames': 0, 'cpuSeconds': 0.0, 'allocSamples': 0, 'allocPeakBytes': 0, 'allocRetainedBytes': 0
+        }
+    cost['frames'] += 1
+    cost['cpuSeconds'] += cpu_seconds
+    if alloc is not None:
+        retained, peak = alloc
+        cost['allocSamples'] += 1
+        cost['allocPeakBytes'] += peak
+        cost['allocRetainedBytes'] += retained
+
+    totals = session_costs.get(session_id)
+    if totals is None:
+        if len(session_costs) >= COST_MAX_SESSIONS:
+            prune_session_costs()
+        totals = session_costs[session_id] = [0, 0.0]
+    totals[0] += 1
+    totals[1] += cpu_seconds
+
+
+def prune_session_costs():
+    """Forget the cheaper half of the tracked sessions"""
+    ranked = sorted(session_costs.items(), key=lambda item: item[1][1])
+    for session_id, _ in ranked[:len(ranked) // 2]:
+        session_costs.pop(session_id, None)
+
+
+def cost_report(top):
+    """Build the /debug/costs report"""
+    # Group live states by exercise to measure state memory from a sample of each
+    states_by_exercise = {}
+    for state in list(exercise_states.values()):
+        states_by_exercise.setdefault(state.get('exerciseType'), []).append(state)
+
+    total_cpu = sum(cost['cpuSeconds'] for cost in exercise_costs.values())
+    exercises = {}
+    # Restored and handed-off sessions have states for exercises not counted here yet
+    for exercise_type in set(exercise_costs) | set(states_by_exercise):
+        cost = exercise_costs.get(exercise_type, {})
+        frames = cost.get('frames', 0)
+        cpu_seconds = cost.get('cpuSeconds', 0.0)
+        samples = cost.get('allocSamples', 0)
+        states = states_by_exercise.get(exercise_type, [])
+        sample = states[:STATE_SIZE_SAMPLE]
+        state_bytes = sum(deep_sizeof(state) for state in sample) / len(sample) if sample else 0
+        exercises[exercise_type] = {
+            'frames': frames,
+            'cpuMs': cpu_seconds * 1000,
+            'cpuUsPerFrame': cpu_seconds / frames * 1e6 if frames else 0.0,
+            'cpuShare': cpu_seconds / total_cpu if total_cpu else 0.0,
+            'allocSamples': samples,
+            'allocPeakBytesPerFrame': cost.get('allocPeakBytes', 0) / samples if samples else None,
+            'allocRetainedBytesPerFrame': cost.get('allocRetainedBytes', 0) / samples if samples else None,
+            'states': len(states),
+            'stateBytesPerState': int(state_bytes),
+            'stateBytes': int(state_bytes * len(states))
+        }
+
+    sessions = []
+    for session_id, (frames, cpu_seconds) in sorted(list(session_costs.items()), key=lambda item: -item[1][1])[:top]:
+        summary = session_summaries.get(session_id, {})
+        state_bytes = sum(deep_sizeof(exercise_states.get(f"{session_id}_{exercise_type}"))
+                          for exercise_type in summary.get('repsByExercise', {}))
+        sessions.append({
+            'sessionId': session_id,
+            'frames': frames,
+            'cpuMs': cpu_seconds * 1000,
+            'cpuUsPerFrame': cpu_seconds / frames * 1e6,
+            'stateBytes': state_bytes + (deep_sizeof(summary) if summary else 0)
+        })
+    return {
+        'pid': os.getpid(),
+        'cpuMs': total_cpu * 1000,
+        'allocSampleRate': COST_ALLOC_SAMPLE_RATE,
+        'allocNote': 'Sampled only while no other request is in flight, but tracemalloc is process-wide: '
+                     'ring consumers and event streams can add to a sample, so these are upper bounds',
+        'exercises': exercises,
+        'trackedSessions': len(session_costs),
+        'sessions': sessions
+    }
+
+
+def start_profile():
+    """Return a profile record if this request should be profiled, else None"""
+    # Read the raw environ so unprofiled requests don't pay for header/query parsing
+    mode = request.environ.get('HTTP_X_PROFILE')
+    if mode and not admin_token_valid(request.environ.get('HTTP_X_ADMIN_TOKEN')):
+        # Profiling costs every request it touches: only admins may ask for it
+        mode = None
+    if not mode:
+        if not PROFILE_SAMPLE_RATE or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        mode = 'full' if PROFILE_CPROFILE else '1'
+
+    now = time.perf_counter()
+    return {
+        'time': int(time.time() * 1000),
+        'mode': 'full' if mode == 'full' else 'stages',
+        'sessionId': None,
+        'exerciseType': None,
+        'stages': {},
+        'start': now,
+        'last': now,
+        'angleSeconds': 0.0,
+        'profiler': None
+    }
+
+
+def profile_mark(profile, stage):
+    """Attribute the time since the previous mark to a stage"""
+    now = time.perf_counter()
+    profile['stages'][stage] = (now - profile['last']) * 1000
+    profile['last'] = now
+
+
+def profile_enter_handler(profile):
+    """Start timing angle computation (and cProfile in full mode) for this thread"""
+    global _profiles_in_flight
+    with _profile_lock:
+        _profiles_in_flight += 1
+    _profile_local.current = profile
+
+    if profile['mode'] == 'full':
+        profile['profiler'] = lazy_import('cProfile').Profile()
+        profile['profiler'].enable()
+
+
+def profile_exit_handler(profile):
+    """Split handler time into angle computation and state machine"""
+    if profile['profiler'] is not None:
+        profile['profiler'].disable()
+    release_profile_thread()
+
+    now = time.perf_counter()
+    handler_ms = (now - profile['last']) * 1000
+    angles_ms = profile['angleSeconds'] * 1000
+    profile['stages']['angles'] = angles_ms
+    profile['stages']['stateMachine'] = handler_ms - angles_ms
+    profile['last'] = now
+
+
+def release_profile_thread():
+    """Stop attributing angle time on this thread to a profile"""
+    global _profiles_in_flight
+    if getattr(_profile_local, 'current', None) is None:
+        return
+    _profile_local.current = None
+    with _profile_lock:
+        _profiles_in_flight -= 1
+
+
+def finish_profile(profile):
+    """Store a completed profile for the debug endpoint"""
+    # Covers requests that failed inside the handler
+    release_profile_thread()
+    if profile['profiler'] is not None:
+        profile['profiler'].disable()
+
+    record = {
+        'time': profile['time'],
+        'sessionId': profile['sessionId'],
+        'exerciseType': profile['exerciseType'],
+        'stagesMs': profile['stages'],
+        'totalMs': (time.perf_counter() - profile['start']) * 1000
+    }
+    if profile['profiler'] is not None:
+        stream = io.StringIO()
+        stats = lazy_import('pstats').Stats(profile['profiler'], stream=stream)
+        stats.sort_stats('cumulative').print_stats(25)
+        record['cProfile'] = stream.getvalue()
+    recent_profiles.append(record)
+
+
+def get_signal(state, name):
+    """Return the named per-session signal state, creating it on first use"""
+    signals = state.get('signals')
+    if signals is None:
+        signals = state['signals'] = {}
+    signal = signals.get(name)
+    if signal is None:
+        signal = signals[name] = {
+            'smoothed': None,
+            'zone': None,
+            'candidate': None,
+            'dwell': 0,
+            'peak': None,
+            'trough': None
+        }
+    return signal
+
+
+def smooth_value(signal, value, alpha):
+    """Exponentially smooth a metric sample"""
+    if not math.isfinite(value):
+        # One bad sample would otherwise stay in the average for good
+        return value if signal['smoothed'] is None else signal['smoothed']
+    if signal['smoothed'] is not None and alpha < 1:
+        value = signal['smoothed'] + alpha * (value - signal['smoothed'])
+    signal['smoothed'] = value
+    return value
+
+
+def hysteresis_zone(value, low, high):
+    """Classify a value as 'low', 'high' or None (inside the hysteresis band)"""
+    if value < low:
+        return 'low'
+    if value > high:
+        return 'high'
+    return None
+
+
+def debounce_zone(signal, zone, min_dwell):
+    """Confirm zone changes that persist for min_dwell frames
+
+    Returns the newly confirmed zone on the frame it is confirmed, else None.
+    Frames inside the hysteresis band (zone None) reset a pending change.
+    """
+    if zone is None or zone == signal['zone']:
+        signal['candidate'] = None
+        signal['dwell'] = 0
+        return None
+
+    if zone == signal['candidate']:
+        signal['dwell'] += 1
+    else:
+        signal['candidate'] = zone
+        signal['dwell'] = 1
+
+    if signal['dwell'] >= min_dwell:
+        signal['zone'] = zone
+        signal['candidate'] = None
+        signal['dwell'] = 0
+        return zone
+    return None
+
+
+def signal_update(signal, value, low, high, signal_params):
+    """Smooth a metric sample and return any confirmed zone change"""
+    value = smooth_value(signal, value, signal_params['alpha'])
+    return debounce_zone(signal, hysteresis_zone(value, low, high), signal_params['minDwell'])
+
+
+def update_extremes(signal, value):
+    """Track the peak and trough of a metric since the last reset"""
+    if signal['peak'] is None or value > signal['peak']:
+        signal['peak'] = value
+    if signal['trough'] is None or value < signal['trough']:
+        signal['trough'] = value
+
+
+def reset_extremes(signal, value):
+    """Restart peak and trough tracking from the current value"""
+    signal['peak'] = signal['trough'] = value
+
+
+def timed_calculate_angle(a, b, c):
+    """Calculate an angle while charging its cost to the current profile"""
+    profile = _profile_local.current
+    _profile_local.current = None
+    start = time.perf_counter()
+    try:
+        return calculate_angle(a, b, c)
+    finally:
+        profile['angleSeconds'] += time.perf_counter() - start
+        _profile_local.current = profile
 
 
 def calculate_angle(a, b, c):
     """Calculate angle between three points"""
+    if _profiles_in_flight and getattr(_profile_local, 'current', None) is not None:
+        return timed_calculate_angle(a, b, c)
+
     try:
         # Convert to vector from pointB to pointA and pointB to pointC
         vector_ba = {
@@ -132,11 +2400,11 @@ def calculate_angle(a, b, c):
         return angle_deg
     
     except Exception as e:
-        print(f"Error calculating angle: {str(e)}")
+        log_error('ANGLE_ERROR', f"Error calculating angle: {e}")
         return 0
 
 
-def process_bicep_curl(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_bicep_curl(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for bicep curl exercise"""
     try:
         # Left arm
@@ -157,7 +2425,7 @@ def process_bicep_curl(landmarks, state, current_time, rep_cooldown, hold_thresh
         angles = {}
 
         # Calculate and store left arm angle
-        if all(k in left_shoulder for k in ['x', 'y']) and all(k in left_elbow for k in ['x', 'y']) and all(k in left_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, LEFT_ARM):
             left_angle = calculate_angle(left_shoulder, left_elbow, left_wrist)
             # Store angle with position data
             angles['L'] = {
@@ -168,17 +2436,16 @@ def process_bicep_curl(landmarks, state, current_time, rep_cooldown, hold_thresh
                 }
             }
 
-            # Detect left arm curl
-            if left_angle > 140:
+            # Detect left arm curl: extended above 140, curled below 50
+            event = signal_update(get_signal(state, 'leftArm'), left_angle, 50, 140, signal_params)
+            if event == 'high':
                 state['leftArmStage'] = "down"
-                state['leftArmHoldStart'] = current_time
-            if left_angle < 50 and state['leftArmStage'] == "down":
-                if current_time - state['leftArmHoldStart'] > hold_threshold:
-                    left_curl_detected = True
-                    state['leftArmStage'] = "up"
+            elif event == 'low' and state['leftArmStage'] == "down":
+                left_curl_detected = True
+                state['leftArmStage'] = "up"
 
         # Calculate and store right arm angle
-        if all(k in right_shoulder for k in ['x', 'y']) and all(k in right_elbow for k in ['x', 'y']) and all(k in right_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, RIGHT_ARM):
             right_angle = calculate_angle(right_shoulder, right_elbow, right_wrist)
             # Store angle with position data
             angles['R'] = {
@@ -189,17 +2456,19 @@ def process_bicep_curl(landmarks, state, current_time, rep_cooldown, hold_thresh
                 }
             }
 
-            # Detect right arm curl
-            if right_angle > 140:
+            # Detect right arm curl: extended above 140, curled below 50
+            event = signal_update(get_signal(state, 'rightArm'), right_angle, 50, 140, signal_params)
+            if event == 'high':
                 state['rightArmStage'] = "down"
-                state['rightArmHoldStart'] = current_time
-            if right_angle < 50 and state['rightArmStage'] == "down":
-                if current_time - state['rightArmHoldStart'] > hold_threshold:
-                    right_curl_detected = True
-                    state['rightArmStage'] = "up"
-
-        # Count rep if either arm completes a curl and enough time has passed since last rep
-        if (left_curl_detected or right_curl_detected) and current_time - state['lastRepTime'] > rep_cooldown:
+            elif event == 'low' and state['rightArmStage'] == "down":
+                right_curl_detected = True
+                state['rightArmStage'] = "up"
+
+        # Count one rep per curl; an arm curling while the other is still up
+        # belongs to the same rep
+        other_arm_up = ((left_curl_detected and not right_curl_detected and state['rightArmStage'] == "up") or
+                        (right_curl_detected and not left_curl_detected and state['leftArmStage'] == "up"))
+        if (left_curl_detected or right_curl_detected) and not other_arm_up:
             state['repCounter'] += 1
             state['lastRepTime'] = current_time
             
@@ -226,15 +2495,16 @@ def process_bicep_curl(landmarks, state, current_time, rep_cooldown, hold_thresh
         }
         
     except Exception as e:
-        print(f"Error in bicep curl detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in bicep curl detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}"
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR'
         }
 
 
-def process_squat(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_squat(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for squat exercise with reduced depth requirement"""
     try:
         # Get landmarks for both legs
@@ -254,7 +2524,7 @@ def process_squat(landmarks, state, current_time, rep_cooldown, hold_threshold):
         feedback = ""
 
         # Calculate left knee angle if landmarks are visible
-        if all(k in left_hip for k in ['x', 'y']) and all(k in left_knee for k in ['x', 'y']) and all(k in left_ankle for k in ['x', 'y']):
+        if is_visible(visible_mask, LEFT_LEG):
             left_knee_angle = calculate_angle(left_hip, left_knee, left_ankle)
             angles['L'] = {
                 'value': left_knee_angle,
@@ -265,7 +2535,7 @@ def process_squat(landmarks, state, current_time, rep_cooldown, hold_threshold):
             }
 
         # Calculate right knee angle if landmarks are visible
-        if all(k in right_hip for k in ['x', 'y']) and all(k in right_knee for k in ['x', 'y']) and all(k in right_ankle for k in ['x', 'y']):
+        if is_visible(visible_mask, RIGHT_LEG):
             right_knee_angle = calculate_angle(right_hip, right_knee, right_ankle)
             angles['R'] = {
                 'value': right_knee_angle,
@@ -294,7 +2564,7 @@ def process_squat(landmarks, state, current_time, rep_cooldown, hold_threshold):
             avg_knee_angle = right_knee_angle
 
         # Calculate hip height (normalized to image height)
-        if all(k in left_hip for k in ['x', 'y']) and all(k in right_hip for k in ['x', 'y']):
+        if is_visible(visible_mask, HIPS):
             hip_height = (left_hip['y'] + right_hip['y']) / 2
             mid_x = (left_hip['x'] + right_hip['x']) / 2
             angles['Hip'] = {
@@ -307,26 +2577,35 @@ def process_squat(landmarks, state, current_time, rep_cooldown, hold_threshold):
 
         # Process squat detection with REDUCED DEPTH REQUIREMENT
         if avg_knee_angle is not None and hip_height is not None:
-            # Standing position detection (straight legs and higher hip position)
-            # Keep the standing position criteria similar to original
-            if avg_knee_angle > 160 and hip_height < 0.6:
-                state['stage'] = "up"
-                state['holdStart'] = current_time
-                feedback = "Standing position"
-            
+            signal = get_signal(state, 'knee')
+            knee_angle = smooth_value(signal, avg_knee_angle, signal_params['alpha'])
+
+            # Standing position: straight legs and higher hip position
             # MODIFIED: Less deep squat position detection
             # Original required avg_knee_angle < 120 and hip_height > 0.65
             # Now we make it easier by:
             # 1. Increasing the knee angle threshold (less bend required)
             # 2. Reducing the hip height requirement (less depth required)
-            if avg_knee_angle < 125 and hip_height > 0.65 and state['stage'] == "up":
-                if current_time - state['holdStart'] > hold_threshold and current_time - state['lastRepTime'] > rep_cooldown:
-                    state['stage'] = "down"
-                    state['repCounter'] += 1
-                    state['lastRepTime'] = current_time
-                    feedback = "Rep complete!"
-                else:
-                    feedback = "Squatting"
+            if knee_angle > 160 and hip_height < 0.6:
+                zone = 'high'
+            elif knee_angle < 125 and hip_height > 0.65:
+                zone = 'low'
+            else:
+                zone = None
+            event = debounce_zone(signal, zone, signal_params['minDwell'])
+
+            if event == 'high':
+                state['stage'] = "up"
+            if zone == 'high' and state['stage'] == "up":
+                feedback = "Standing position"
+
+            if event == 'low' and state['stage'] == "up":
+                state['stage'] = "down"
+                state['repCounter'] += 1
+                state['lastRepTime'] = current_time
+                feedback = "Rep complete!"
+            elif zone == 'low' and state['stage'] == "up":
+                feedback = "Squatting"
 
         return {
             'repCounter': state['repCounter'],
@@ -337,15 +2616,16 @@ def process_squat(landmarks, state, current_time, rep_cooldown, hold_threshold):
         }
         
     except Exception as e:
-        print(f"Error in squat detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in squat detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}",
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR',
             'angles': {}
         }
 
-def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_pushup(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for pushup exercise using similar logic to the JavaScript implementation"""
     try:
         # Get landmarks for both arms and shoulders
@@ -372,7 +2652,7 @@ def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold)
         warnings = []
 
         # Calculate left arm angle if landmarks are visible
-        if all(k in left_shoulder for k in ['x', 'y']) and all(k in left_elbow for k in ['x', 'y']) and all(k in left_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, LEFT_ARM):
             left_elbow_angle = calculate_angle(left_shoulder, left_elbow, left_wrist)
             angles['L'] = {
                 'value': left_elbow_angle,
@@ -383,7 +2663,7 @@ def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold)
             }
 
         # Calculate right arm angle if landmarks are visible
-        if all(k in right_shoulder for k in ['x', 'y']) and all(k in right_elbow for k in ['x', 'y']) and all(k in right_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, RIGHT_ARM):
             right_elbow_angle = calculate_angle(right_shoulder, right_elbow, right_wrist)
             angles['R'] = {
                 'value': right_elbow_angle,
@@ -412,7 +2692,7 @@ def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold)
             avg_elbow_angle = right_elbow_angle
 
         # Calculate body height (y-coordinate of shoulders)
-        if all(k in left_shoulder for k in ['x', 'y']) and all(k in right_shoulder for k in ['x', 'y']):
+        if is_visible(visible_mask, SHOULDERS):
             body_height = (left_shoulder['y'] + right_shoulder['y']) / 2
             mid_x = (left_shoulder['x'] + right_shoulder['x']) / 2
             angles['Height'] = {
@@ -424,8 +2704,7 @@ def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold)
             }
 
         # Check body alignment (straight back)
-        if (all(k in left_shoulder for k in ['x', 'y']) and all(k in right_shoulder for k in ['x', 'y']) and 
-            all(k in left_hip for k in ['x', 'y']) and all(k in right_hip for k in ['x', 'y'])):
+        if is_visible(visible_mask, SHOULDERS | HIPS):
             
             shoulder_mid_x = (left_shoulder['x'] + right_shoulder['x']) / 2
             shoulder_mid_y = (left_shoulder['y'] + right_shoulder['y']) / 2
@@ -456,23 +2735,32 @@ def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold)
         # Process pushup detection using elbow angles, body height, and alignment
         status = ""
         if avg_elbow_angle is not None and body_height is not None:
-            # Up position detection (straight arms, higher body position)
-            if avg_elbow_angle > 160 and body_height < 0.7:
+            signal = get_signal(state, 'elbow')
+            elbow_angle = smooth_value(signal, avg_elbow_angle, signal_params['alpha'])
+
+            # Up position: straight arms, higher body position; down position: bent arms
+            if elbow_angle > 160 and body_height < 0.7:
+                zone = 'high'
+            elif elbow_angle < 90:
+                zone = 'low'
+            else:
+                zone = None
+            event = debounce_zone(signal, zone, signal_params['minDwell'])
+
+            if event == 'high':
                 state['stage'] = "up"
-                state['holdStart'] = current_time
+            if zone == 'high' and state['stage'] == "up":
                 status = "Up Position"
 
-            # Down position detection (bent arms, lower body position)
-            if avg_elbow_angle < 90 and state['stage'] == "up":
-                if current_time - state['holdStart'] > hold_threshold and current_time - state['lastRepTime'] > rep_cooldown:
-                    state['stage'] = "down"
-                    state['repCounter'] += 1
-                    state['lastRepTime'] = current_time
-                    status = "Rep Complete!"
-                    feedback = "Rep complete! Good pushup."
-                else:
-                    status = "Down Position"
-                    feedback = "Down position - hold briefly"
+            if event == 'low' and state['stage'] == "up":
+                state['stage'] = "down"
+                state['repCounter'] += 1
+                state['lastRepTime'] = current_time
+                status = "Rep Complete!"
+                feedback = "Rep complete! Good pushup."
+            elif zone == 'low' and state['stage'] == "up":
+                status = "Down Position"
+                feedback = "Down position - hold briefly"
 
         return {
             'repCounter': state['repCounter'],
@@ -484,18 +2772,19 @@ def process_pushup(landmarks, state, current_time, rep_cooldown, hold_threshold)
         }
         
     except Exception as e:
-        print(f"Error in pushup detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in pushup detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}",
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR',
             'angles': {},
             'status': "",
             'warnings': []
         }
 
 
-def process_shoulder_press(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_shoulder_press(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for shoulder press exercise with improved position tracking"""
     try:
         # Get landmarks for both arms
@@ -517,18 +2806,12 @@ def process_shoulder_press(landmarks, state, current_time, rep_cooldown, hold_th
         # Store wrist positions for vertical movement tracking
         left_wrist_y = None
         right_wrist_y = None
-        
-        # Add position history tracking if not present in state
-        if 'prev_left_wrist_y' not in state:
-            state['prev_left_wrist_y'] = None
-        if 'prev_right_wrist_y' not in state:
-            state['prev_right_wrist_y'] = None
             
         angles = {}
         feedback = ""
 
         # Calculate left arm position and angle
-        if all(k in left_shoulder for k in ['x', 'y']) and all(k in left_elbow for k in ['x', 'y']) and all(k in left_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, LEFT_ARM):
             left_elbow_angle = calculate_angle(left_wrist, left_elbow, left_shoulder)
             angles['L'] = {
                 'value': left_elbow_angle,
@@ -556,7 +2839,7 @@ def process_shoulder_press(landmarks, state, current_time, rep_cooldown, hold_th
             }
 
         # Calculate right arm position and angle
-        if all(k in right_shoulder for k in ['x', 'y']) and all(k in right_elbow for k in ['x', 'y']) and all(k in right_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, RIGHT_ARM):
             right_elbow_angle = calculate_angle(right_wrist, right_elbow, right_shoulder)
             angles['R'] = {
                 'value': right_elbow_angle,
@@ -606,73 +2889,61 @@ def process_shoulder_press(landmarks, state, current_time, rep_cooldown, hold_th
         one_wrist_above_shoulder = left_wrist_above_shoulder or right_wrist_above_shoulder
         elbows_at_shoulder_level = (left_elbow_at_shoulder or right_elbow_at_shoulder)
         
-        # NEW: Detect upward movement by comparing current and previous wrist positions
-        moving_upward = False
-        
-        # For left arm movement
-        if left_wrist_y is not None and state['prev_left_wrist_y'] is not None:
-            left_moving_up = left_wrist_y < state['prev_left_wrist_y']
-            angles['LMovingUp'] = {
-                'value': 1 if left_moving_up else 0,
-                'position': {
-                    'x': left_wrist['x'] - 0.1,
-                    'y': left_wrist['y']
-                }
-            }
-        else:
-            left_moving_up = False
-            
-        # For right arm movement
-        if right_wrist_y is not None and state['prev_right_wrist_y'] is not None:
-            right_moving_up = right_wrist_y < state['prev_right_wrist_y']
-            angles['RMovingUp'] = {
-                'value': 1 if right_moving_up else 0,
-                'position': {
-                    'x': right_wrist['x'] + 0.1,
-                    'y': right_wrist['y']
-                }
-            }
-        else:
-            right_moving_up = False
-            
-        # Consider moving upward if either arm is clearly moving up
-        # Use a significant threshold to avoid minor fluctuations
-        if (left_moving_up and left_wrist_y is not None and state['prev_left_wrist_y'] is not None and 
-           (state['prev_left_wrist_y'] - left_wrist_y > 0.01)):
-            moving_upward = True
-        if (right_moving_up and right_wrist_y is not None and state['prev_right_wrist_y'] is not None and 
-           (state['prev_right_wrist_y'] - right_wrist_y > 0.01)):
-            moving_upward = True
-        
         # Process shoulder press detection with position tracking
         if avg_elbow_angle is not None:
+            signal = get_signal(state, 'elbow')
+            elbow_angle = smooth_value(signal, avg_elbow_angle, signal_params['alpha'])
+
             # DOWN POSITION: Arms bent, elbows near shoulders
-            in_down_position = (avg_elbow_angle < 120) and (elbows_at_shoulder_level or not both_wrists_above_shoulder)
+            in_down_position = (elbow_angle < 120) and (elbows_at_shoulder_level or not both_wrists_above_shoulder)
             
             # UP POSITION: Arms extended, wrists above shoulders
-            in_up_position = (avg_elbow_angle > 140 and both_wrists_above_shoulder) or (avg_elbow_angle > 150 and one_wrist_above_shoulder)
+            in_up_position = (elbow_angle > 140 and both_wrists_above_shoulder) or (elbow_angle > 150 and one_wrist_above_shoulder)
+
+            zone = 'low' if in_down_position else 'high' if in_up_position else None
+            event = debounce_zone(signal, zone, signal_params['minDwell'])
+
+            # Detect upward movement as the rise of each wrist above its lowest point
+            # since the down position; unlike a frame-to-frame delta this does not
+            # depend on the frame rate
+            moving_upward = False
+            for key, wrist_y, wrist, offset in (('leftWrist', left_wrist_y, left_wrist, -0.1),
+                                                ('rightWrist', right_wrist_y, right_wrist, 0.1)):
+                if wrist_y is None:
+                    continue
+                wrist_signal = get_signal(state, key)
+                if in_down_position:
+                    reset_extremes(wrist_signal, wrist_y)
+                else:
+                    update_extremes(wrist_signal, wrist_y)
+                # Image y grows downwards, so the lowest wrist position is the peak y
+                rise = wrist_signal['peak'] - wrist_y
+                moving_up = rise > PRESS_MIN_RISE
+                moving_upward = moving_upward or moving_up
+                angles[key[0].upper() + 'MovingUp'] = {
+                    'value': 1 if moving_up else 0,
+                    'position': {
+                        'x': wrist['x'] + offset,
+                        'y': wrist['y']
+                    }
+                }
             
             # STATE TRANSITIONS with movement verification
-            if in_down_position:
+            if zone == 'low':
                 # If we were previously in the up position and now in down, we're ready for next rep
-                if state['stage'] == "up":
+                if event == 'low' and state['stage'] == "up":
                     state['stage'] = "down"
                     feedback = "Ready for next rep"
                 elif state['stage'] == "down":
                     feedback = "Ready position"
                 
-                state['holdStart'] = current_time
-                
-            elif in_up_position:
+            elif zone == 'high':
                 # NEW: Only count rep if we were in down position AND we detected upward movement
-                if state['stage'] == "down" and moving_upward:
-                    if current_time - state['lastRepTime'] > rep_cooldown:
-                        state['repCounter'] += 1
-                        state['lastRepTime'] = current_time
-                        state['stage'] = "up"
-                        feedback = "Rep complete!"
-                    else:
-                        feedback = "Slow down slightly"
+                if event == 'high' and state['stage'] == "down" and moving_upward:
+                    state['repCounter'] += 1
+                    state['lastRepTime'] = current_time
+                    state['stage'] = "up"
+                    feedback = "Rep complete!"
                 elif state['stage'] == "up":
                     feedback = "Lower arms to shoulder level for next rep"
             
@@ -685,10 +2956,6 @@ def process_shoulder_press(landmarks, state, current_time, rep_cooldown, hold_th
                 else:
                     feedback = "Continue the movement"
 
-        # Update position history for next frame
-        state['prev_left_wrist_y'] = left_wrist_y
-        state['prev_right_wrist_y'] = right_wrist_y
-
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
@@ -697,14 +2964,15 @@ def process_shoulder_press(landmarks, state, current_time, rep_cooldown, hold_th
         }
         
     except Exception as e:
-        print(f"Error in shoulder press detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in shoulder press detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}"
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR'
         }
 
-def process_tricep_extension(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_tricep_extension(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for floor tricep extension exercise"""
     try:
         # Left arm
@@ -726,7 +2994,7 @@ def process_tricep_extension(landmarks, state, current_time, rep_cooldown, hold_
         feedback = ""
 
         # Calculate and store left arm angle
-        if all(k in left_shoulder for k in ['x', 'y']) and all(k in left_elbow for k in ['x', 'y']) and all(k in left_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, LEFT_ARM):
             left_angle = calculate_angle(left_shoulder, left_elbow, left_wrist)
             # Store angle with position data
             angles['L'] = {
@@ -737,17 +3005,16 @@ def process_tricep_extension(landmarks, state, current_time, rep_cooldown, hold_
                 }
             }
 
-            # Detect left arm extension
-            if left_angle < 100:  # Arm is bent (starting position)
+            # Detect left arm extension: bent below 100 (starting position), extended above 140
+            event = signal_update(get_signal(state, 'leftArm'), left_angle, 100, 140, signal_params)
+            if event == 'low':
                 state['leftArmStage'] = "down"
-                state['leftArmHoldStart'] = current_time
-            if left_angle > 140 and state['leftArmStage'] == "down":  # Arm is extended
-                if current_time - state['leftArmHoldStart'] > hold_threshold:
-                    left_extension_detected = True
-                    state['leftArmStage'] = "up"
+            elif event == 'high' and state['leftArmStage'] == "down":
+                left_extension_detected = True
+                state['leftArmStage'] = "up"
 
         # Calculate and store right arm angle
-        if all(k in right_shoulder for k in ['x', 'y']) and all(k in right_elbow for k in ['x', 'y']) and all(k in right_wrist for k in ['x', 'y']):
+        if is_visible(visible_mask, RIGHT_ARM):
             right_angle = calculate_angle(right_shoulder, right_elbow, right_wrist)
             # Store angle with position data
             angles['R'] = {
@@ -758,43 +3025,44 @@ def process_tricep_extension(landmarks, state, current_time, rep_cooldown, hold_
                 }
             }
 
-            # Detect right arm extension
-            if right_angle < 100:  # Arm is bent (starting position)
+            # Detect right arm extension: bent below 100 (starting position), extended above 140
+            event = signal_update(get_signal(state, 'rightArm'), right_angle, 100, 140, signal_params)
+            if event == 'low':
                 state['rightArmStage'] = "down"
-                state['rightArmHoldStart'] = current_time
-            if right_angle > 140 and state['rightArmStage'] == "down":  # Arm is extended
-                if current_time - state['rightArmHoldStart'] > hold_threshold:
-                    right_extension_detected = True
-                    state['rightArmStage'] = "up"
-
-        # Count rep only if both arms complete an extension and enough time has passed since last rep
-        if (left_extension_detected and right_extension_detected) and current_time - state['lastRepTime'] > rep_cooldown:
+            elif event == 'high' and state['rightArmStage'] == "down":
+                right_extension_detected = True
+                state['rightArmStage'] = "up"
+
+        # Count rep once both arms are extended, on the frame the second one gets there
+        both_extended = state['leftArmStage'] == "up" and state['rightArmStage'] == "up"
+        if both_extended and (left_extension_detected or right_extension_detected):
             state['repCounter'] += 1
             state['lastRepTime'] = current_time
             feedback = "Good rep! Both arms extended."
         else:
             # Simple feedback
-            if left_extension_detected and not right_extension_detected:
+            if state['leftArmStage'] == "up" and state['rightArmStage'] != "up":
                 feedback = "Extend your right arm too"
-            elif not left_extension_detected and right_extension_detected:
+            elif state['leftArmStage'] != "up" and state['rightArmStage'] == "up":
                 feedback = "Extend your left arm too"
 
         return {
             'repCounter': state['repCounter'],
-            'stage': 'up' if (left_extension_detected and right_extension_detected) else 'down',
+            'stage': 'up' if both_extended else 'down',
             'feedback': feedback,
             'angles': angles
         }
         
     except Exception as e:
-        print(f"Error in tricep extension detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in tricep extension detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}"
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR'
         }
 
-def process_lunge(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_lunge(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for lunge exercise with more lenient detection criteria"""
     try:
         # Get landmarks for both sides of the body
@@ -806,16 +3074,11 @@ def process_lunge(landmarks, state, current_time, rep_cooldown, hold_threshold):
         right_ankle = landmarks[28]
 
         # Check if all landmarks are present with x, y coordinates
-        all_landmarks_visible = all(
-            point and all(k in point for k in ['x', 'y']) 
-            for point in [left_hip, left_knee, left_ankle, right_hip, right_knee, right_ankle]
-        )
+        all_landmarks_visible = is_visible(visible_mask, LEFT_LEG | RIGHT_LEG)
         
         # Partial visibility check - at least one leg should be fully visible
-        left_leg_visible = all(k in point for k in ['x', 'y'] 
-                              for point in [left_hip, left_knee, left_ankle])
-        right_leg_visible = all(k in point for k in ['x', 'y'] 
-                               for point in [right_hip, right_knee, right_ankle])
+        left_leg_visible = is_visible(visible_mask, LEFT_LEG)
+        right_leg_visible = is_visible(visible_mask, RIGHT_LEG)
         
         if not (left_leg_visible or right_leg_visible):
             return {
@@ -919,11 +3182,6 @@ def process_lunge(landmarks, state, current_time, rep_cooldown, hold_threshold):
         elif right_leg_visible and right_leg_angle > 140:
             # Only right leg visible and it's straight
             standing_detected = True
-            
-        if standing_detected:
-            state['stage'] = "up"
-            state['holdStart'] = current_time
-            feedback = "Standing position - prepare for lunge"
 
         # Proper lunge detection - MORE LENIENT CRITERIA
         lunge_detected = False
@@ -943,15 +3201,23 @@ def process_lunge(landmarks, state, current_time, rep_cooldown, hold_threshold):
         elif right_leg_visible and right_leg_angle < 130:
             # Right leg is bent enough to potentially be in lunge position
             lunge_detected = True
+
+        # Debounce position changes so a single noisy frame can't flip the stage
+        zone = 'high' if standing_detected else 'low' if lunge_detected else None
+        event = debounce_zone(get_signal(state, 'position'), zone, signal_params['minDwell'])
+
+        if event == 'high':
+            state['stage'] = "up"
+        if zone == 'high' and state['stage'] == "up":
+            feedback = "Standing position - prepare for lunge"
             
-        if lunge_detected and state['stage'] == "up":
-            if current_time - state['holdStart'] > hold_threshold and current_time - state['lastRepTime'] > rep_cooldown:
-                state['stage'] = "down"
-                state['repCounter'] += 1
-                state['lastRepTime'] = current_time
-                feedback = "Rep complete! Good lunge."
-            else:
-                feedback = "Lunge position - hold it"
+        if event == 'low' and state['stage'] == "up":
+            state['stage'] = "down"
+            state['repCounter'] += 1
+            state['lastRepTime'] = current_time
+            feedback = "Rep complete! Good lunge."
+        elif zone == 'low' and state['stage'] == "up":
+            feedback = "Lunge position - hold it"
         
         # Simplified feedback - less critical of form
         if state['stage'] == "down" and not feedback:
@@ -967,16 +3233,17 @@ def process_lunge(landmarks, state, current_time, rep_cooldown, hold_threshold):
         }
         
     except Exception as e:
-        print(f"Error in lunge detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in lunge detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}",
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR',
             'angles': {}
         }
 
 
-def process_calf_raises(landmarks, state, current_time, rep_cooldown, hold_threshold):
+def process_calf_raises(landmarks, state, current_time, signal_params=DEFAULT_SIGNAL_PARAMS, visible_mask=ALL_VISIBLE):
     """Process landmarks for calf raises exercise with more lenient detection"""
     try:
         # Get landmarks for ankles, knees, and feet
@@ -994,11 +3261,9 @@ def process_calf_raises(landmarks, state, current_time, rep_cooldown, hold_thres
         feedback = ""
         
         # Check if at least one foot is visible with required landmarks
-        left_foot_visible = all(point and all(k in point for k in ['x', 'y']) 
-                              for point in [left_ankle, left_heel, left_foot_index])
+        left_foot_visible = is_visible(visible_mask, LEFT_FOOT)
         
-        right_foot_visible = all(point and all(k in point for k in ['x', 'y']) 
-                               for point in [right_ankle, right_heel, right_foot_index])
+        right_foot_visible = is_visible(visible_mask, RIGHT_FOOT)
         
         if not (left_foot_visible or right_foot_visible):
             return {
@@ -1091,32 +3356,27 @@ def process_calf_raises(landmarks, state, current_time, rep_cooldown, hold_thres
         # Define the stages with more lenient thresholds
         # "down" = feet mostly flat, "up" = heels raised
         
-        # MODIFIED: Less strict requirement for flat feet (down position)
-        # Allow for slight heel elevation in the starting position
-        if avg_heel_lift < 0.015:  # Small threshold for heel raise (was 0.01)
+        # MODIFIED: Less strict requirement for flat feet (down position) and any
+        # noticeable heel raise accepted for the up position. The single 0.015
+        # cut-off is split into a hysteresis band so noise around it can't toggle
+        signal = get_signal(state, 'heelLift')
+        event = signal_update(signal, avg_heel_lift, 0.012, 0.018, signal_params)
+        heel_raised = signal['smoothed'] > 0.018
+
+        if signal['zone'] == 'low':
             # If we were in the up position, complete the rep cycle
-            if state['stage'] == "up":
-                state['stage'] = "down"
+            if event == 'low' and state['stage'] == "up":
                 feedback = "Good! Ready for next rep"
             else:
-                state['stage'] = "down"
                 feedback = "Starting position - feet flat"
-                
-            state['holdStart'] = current_time
-        
-        # MODIFIED: Less strict requirement for raised position (up position)
-        # Any noticeable heel raise is accepted
-        heel_raised = avg_heel_lift > 0.015  # Lower threshold for heel raise detection (was 0.02)
+            state['stage'] = "down"
         
         # Completely remove the foot angle requirement for counting reps
-        if heel_raised and state['stage'] == "down":
-            if current_time - state['lastRepTime'] > rep_cooldown:
-                state['stage'] = "up"
-                state['repCounter'] += 1
-                state['lastRepTime'] = current_time
-                feedback = "Rep counted! Good raise."
-            else:
-                feedback = "Slow down slightly"
+        if event == 'high' and state['stage'] == "down":
+            state['stage'] = "up"
+            state['repCounter'] += 1
+            state['lastRepTime'] = current_time
+            feedback = "Rep counted! Good raise."
                 
         # Form feedback
         if state['stage'] == "up" and not feedback:
@@ -1132,17 +3392,47 @@ def process_calf_raises(landmarks, state, current_time, rep_cooldown, hold_thres
         }
         
     except Exception as e:
-        print(f"Error in calf raise detection: {str(e)}")
+        log_error('HANDLER_ERROR', f"Error in calf raise detection: {e}")
         return {
             'repCounter': state['repCounter'],
             'stage': state['stage'],
-            'feedback': f"Error: {str(e)}",
+            'feedback': '',
+            'errorCode': 'HANDLER_ERROR',
             'angles': {}
         }
 
 
+# Built-in exercise handlers, keyed by exerciseType
+BUILTIN_HANDLERS = {
+    'bicepCurl': process_bicep_curl,
+    'squat': process_squat,
+    'pushup': process_pushup,
+    'shoulderPress': process_shoulder_press,
+    'tricepExtension': process_tricep_extension,
+    'lunge': process_lunge,
+    'calfRaises': process_calf_raises
+}
+
+# All exercise handlers, built-in and config-defined
+exercise_handlers = dict(BUILTIN_HANDLERS)
+reload_custom_exercises()
+if CLUSTER_CONFIG:
+    reload_cluster_config()
+
+
+# Build the precompressed frontend once at startup (in the master when preloading)
+if SERVE_FRONTEND:
+    build_frontend_assets()
+
+
 # Run the app
 if __name__ == '__main__':
     # Get port from environment variable or use default (8080)
     port = int(os.environ.get("PORT", 8080))
+    if SNAPSHOT_DIR:
+        start_snapshotting()
+    if CLUSTER_CONFIG:
+        start_cluster_watch()
+    if LANDMARK_RINGS:
+        start_ring_consumers()
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,52 @@
+"""Measure how long a fresh worker takes to import the app and serve a request.
+
+Usage: python bench_startup.py [runs] [max_median_seconds]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Imports the app the way a gunicorn worker does and serves one request
+WORKER_SNIPPET = """
+import app
+response = app.app.test_client().get('/')
+assert response.status_code == 200
+"""
+
+
+def measure_once():
+    """Return the wall time in seconds from process spawn to first response"""
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-c', WORKER_SNIPPET],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    max_median = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    # Baseline: bare interpreter startup, to separate it from the app's own cost
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    interpreter = time.perf_counter() - start
+
+    timings = [measure_once() for _ in range(runs)]
+    median = statistics.median(timings)
+
+    print(f"interpreter startup: {interpreter * 1000:.1f} ms")
+    print(f"worker ready (n={runs}): min {min(timings) * 1000:.1f} ms, "
+          f"median {median * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+
+    if median > max_median:
+        print(f"FAIL: median startup above {max_median:.2f} s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
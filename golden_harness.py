@@ -0,0 +1,323 @@
+"""Golden-dataset accuracy and per-frame cost regression harness for the rep counters.
+
+Builds a deterministic corpus of synthetic landmark sequences for every exercise
+(clean and noisy, at several frame rates), each labelled with the times its reps
+should be counted. Every sequence is validated and fed through app.count_frame,
+the counting path /process_landmarks and the ring consumer share, as a fresh
+session. A case passes when the rep count matches and each rep lands within
+REP_TOLERANCE periods of its label. tests/test_golden.py runs the same cases.
+
+Per-frame cost is measured per exercise as a ratio to a frozen reference
+handler, timed in alternating runs so both see the same CPU speed, cache and
+frequency state; the median ratio is compared with the baseline. A speedup is
+only acceptable if every accuracy case still passes.
+
+Usage: python golden_harness.py [--runs N] [--max-slowdown F] [--update-baseline]
+"""
+import argparse
+import gc
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+import app
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_baseline.json')
+
+# Reps must be counted within this fraction of a period of the labelled time
+REP_TOLERANCE = 0.3
+
+# Timed runs replay the noisy 30 fps sequence this many times, long enough to
+# keep timer and scheduler jitter small
+TIMING_REPEATS = 5
+
+# Each run counts as a new session so state from earlier runs can't leak in
+_session_ids = itertools.count()
+
+# Seconds of rest before the first rep and after the last one
+LEAD_IN = 1.0
+LEAD_OUT = 1.0
+
+
+def neutral_pose():
+    """A person standing square to the camera with arms hanging down"""
+    pose = [{'x': 0.5, 'y': 0.5, 'z': 0.0, 'visibility': 0.99} for _ in range(33)]
+    points = {
+        0: (0.5, 0.15),
+        11: (0.42, 0.3), 12: (0.58, 0.3),
+        13: (0.42, 0.45), 14: (0.58, 0.45),
+        15: (0.42, 0.6), 16: (0.58, 0.6),
+        23: (0.45, 0.55), 24: (0.55, 0.55),
+        25: (0.45, 0.72), 26: (0.55, 0.72),
+        27: (0.45, 0.9), 28: (0.55, 0.9),
+        29: (0.44, 0.91), 30: (0.56, 0.91),
+        31: (0.47, 0.93), 32: (0.53, 0.93)
+    }
+    for index, (x, y) in points.items():
+        pose[index] = {'x': x, 'y': y, 'z': 0.0, 'visibility': 0.99}
+    return pose
+
+
+def place(pose, index, origin, length, angle, side):
+    """Put a landmark `length` from `origin`, `angle` degrees outward from straight down"""
+    radians = math.radians(angle)
+    pose[index] = {'x': origin['x'] + side * length * math.sin(radians),
+                   'y': origin['y'] + length * math.cos(radians), 'z': 0.0, 'visibility': 0.99}
+
+
+def set_elbows(pose, elbow_angle, upper_arm_angle=0.0):
+    """Pose both arms: upper arm `upper_arm_angle` out from hanging, elbow bent to `elbow_angle`"""
+    for shoulder, elbow, wrist, side in ((11, 13, 15, -1), (12, 14, 16, 1)):
+        place(pose, elbow, pose[shoulder], 0.15, upper_arm_angle, side)
+        place(pose, wrist, pose[elbow], 0.15, upper_arm_angle + 180 - elbow_angle, side)
+
+
+def set_knees(pose, knee_angle):
+    """Pose both legs with the shins vertical and the knees bent to `knee_angle`"""
+    for hip, knee, side in ((23, 25, -1), (24, 26, 1)):
+        place(pose, hip, pose[knee], 0.17, knee_angle, side)
+
+
+def lerp(a, b, s):
+    return a + (b - a) * s
+
+
+def bicep_curl(s):
+    pose = neutral_pose()
+    set_elbows(pose, lerp(170, 30, s))
+    return pose
+
+
+def tricep_extension(s):
+    pose = neutral_pose()
+    set_elbows(pose, lerp(80, 170, s))
+    return pose
+
+
+def pushup(s):
+    pose = neutral_pose()
+    set_elbows(pose, lerp(170, 70, s))
+    return pose
+
+
+def shoulder_press(s):
+    # From elbows out at shoulder height with forearms up, to arms extended overhead
+    pose = neutral_pose()
+    set_elbows(pose, lerp(80, 178, s), lerp(85, 175, s))
+    return pose
+
+
+def squat(s):
+    pose = neutral_pose()
+    set_knees(pose, lerp(178, 85, s))
+    return pose
+
+
+def lunge(s):
+    # Left leg steps forward and bends while the back knee drops
+    pose = neutral_pose()
+    targets = {23: (0.47, 0.62), 25: (0.33, 0.66), 27: (0.33, 0.9),
+               24: (0.55, 0.62), 26: (0.6, 0.84), 28: (0.66, 0.93)}
+    for index, (x, y) in targets.items():
+        pose[index]['x'] = lerp(pose[index]['x'], x, s)
+        pose[index]['y'] = lerp(pose[index]['y'], y, s)
+    return pose
+
+
+def calf_raises(s):
+    pose = neutral_pose()
+    for heel in (29, 30):
+        pose[heel]['y'] = lerp(0.91, 0.87, s)
+    return pose
+
+
+def lateral_raise(s):
+    pose = neutral_pose()
+    set_elbows(pose, 175, lerp(10, 95, s))
+    return pose
+
+
+# Exercise -> (pose at movement phase s in [0, 1], seconds per rep); reps are
+# counted as the movement reaches s = 1
+MOVEMENTS = {
+    'bicepCurl': (bicep_curl, 2.0),
+    'tricepExtension': (tricep_extension, 2.0),
+    'pushup': (pushup, 2.0),
+    'shoulderPress': (shoulder_press, 2.5),
+    'squat': (squat, 2.5),
+    'lunge': (lunge, 3.0),
+    'calfRaises': (calf_raises, 2.0),
+    'lateralRaise': (lateral_raise, 2.5)
+}
+
+# Name -> (frames per second, landmark jitter, reps)
+VARIANTS = {
+    'clean30': (30, 0.0, 5),
+    'noisy30': (30, 0.004, 5),
+    'clean10': (10, 0.0, 4),
+    'noisy15': (15, 0.004, 4)
+}
+
+
+def build_case(exercise_type, variant):
+    """Return (frames as (time ms, landmarks), labelled rep times in ms, period ms)"""
+    movement, period = MOVEMENTS[exercise_type]
+    fps, jitter, reps = VARIANTS[variant]
+    rng = random.Random(f"{exercise_type}/{variant}")
+    duration = LEAD_IN + reps * period + LEAD_OUT
+
+    frames = []
+    for i in range(int(duration * fps)):
+        t = i / fps
+        cycle = (t - LEAD_IN) / period
+        s = 0.5 - 0.5 * math.cos(2 * math.pi * cycle) if 0 <= cycle < reps else 0.0
+        landmarks = movement(s)
+        if jitter:
+            for point in landmarks:
+                point['x'] += rng.gauss(0, jitter)
+                point['y'] += rng.gauss(0, jitter)
+        frames.append((int(1000 * (1000 + t)), landmarks))
+    labels = [int(1000 * (1000 + LEAD_IN + (k + 0.5) * period)) for k in range(reps)]
+    return frames, labels, period * 1000
+
+
+def run_frames(exercise_type, frames, signal_params=app.DEFAULT_SIGNAL_PARAMS):
+    """Feed frames through the request path as a new session; return rep times and seconds per frame"""
+    handler = app.exercise_handlers[exercise_type]
+    session_id = f"golden_{next(_session_ids)}"
+    client_key = f"{session_id}_{exercise_type}"
+    rep_times = []
+    reps = 0
+    start = time.perf_counter()
+    for current_time, landmarks in frames:
+        error_code, visible_mask = app.validate_payload(landmarks, exercise_type, session_id)
+        if error_code is not None:
+            raise ValueError(f"{exercise_type}: corpus frame rejected with {error_code}")
+        app.count_frame(session_id, exercise_type, handler, landmarks, visible_mask, current_time,
+                        signal_params=signal_params)
+        if app.exercise_states[client_key]['repCounter'] > reps:
+            reps = app.exercise_states[client_key]['repCounter']
+            rep_times.append(current_time)
+    elapsed = time.perf_counter() - start
+    app.drop_session(session_id)
+    return rep_times, elapsed / len(frames)
+
+
+def reference_frames(frames):
+    """Seconds per frame for a frozen stand-in handler: elbow angles, smoothing and a stage machine
+
+    Kept independent of app so it measures the machine, not the code under test.
+    """
+    state = {'angle': None, 'stage': 'down', 'reps': 0}
+    start = time.perf_counter()
+    for current_time, landmarks in frames:
+        for point in landmarks:
+            if not (0.0 <= point['x'] <= 1.0 and 0.0 <= point['y'] <= 1.0 and point['visibility'] >= 0.5):
+                break
+        angles = []
+        for a, b, c in ((11, 13, 15), (12, 14, 16)):
+            first, mid, end = landmarks[a], landmarks[b], landmarks[c]
+            radians = (math.atan2(end['y'] - mid['y'], end['x'] - mid['x'])
+                       - math.atan2(first['y'] - mid['y'], first['x'] - mid['x']))
+            angle = abs(radians * 180.0 / math.pi)
+            angles.append(360 - angle if angle > 180.0 else angle)
+        angle = sum(angles) / 2
+        state['angle'] = angle if state['angle'] is None else 0.5 * angle + 0.5 * state['angle']
+        if state['angle'] > 150:
+            state['stage'] = 'down'
+        elif state['angle'] < 50 and state['stage'] == 'down':
+            state['stage'] = 'up'
+            state['reps'] += 1
+            state['lastRepTime'] = current_time
+    return (time.perf_counter() - start) / len(frames)
+
+
+def check_accuracy(rep_times, labels, period_ms):
+    """Return None if the reps match the labels, else a description of the mismatch"""
+    if len(rep_times) != len(labels):
+        return f"counted {len(rep_times)} reps, expected {len(labels)}"
+    for actual, expected in zip(rep_times, labels):
+        if abs(actual - expected) > REP_TOLERANCE * period_ms:
+            return f"rep at {(actual - expected) / period_ms:+.2f} periods from its label"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=9,
+                        help='alternating exercise/reference timing runs per exercise (the median ratio is kept)')
+    parser.add_argument('--max-slowdown', type=float, default=0.25,
+                        help='allowed relative increase in per-frame cost over the baseline')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='record current per-frame costs as the baseline (only if accuracy passes)')
+    args = parser.parse_args()
+
+    failures = []
+    costs = {}
+    relative = {}
+    for exercise_type in MOVEMENTS:
+        if exercise_type not in app.exercise_handlers:
+            print(f"{exercise_type:16} skipped: not defined in this build")
+            continue
+        for variant in VARIANTS:
+            frames, labels, period_ms = build_case(exercise_type, variant)
+            rep_times, _ = run_frames(exercise_type, frames)
+            problem = check_accuracy(rep_times, labels, period_ms)
+            if problem:
+                failures.append(f"{exercise_type}/{variant}: {problem}")
+            print(f"{exercise_type:16} {variant:8} {len(rep_times)}/{len(labels)} reps"
+                  f"{'  FAIL: ' + problem if problem else ''}")
+
+        # Time with the collector off so a stray collection doesn't land in one
+        # exercise, alternating with the reference so a slow patch of the
+        # machine hits both sides of a ratio rather than one exercise
+        frames = build_case(exercise_type, 'noisy30')[0] * TIMING_REPEATS
+        run_frames(exercise_type, frames)
+        gc.collect()
+        gc.disable()
+        runs = []
+        for _ in range(args.runs):
+            reference = reference_frames(frames)
+            runs.append((run_frames(exercise_type, frames)[1], reference))
+        gc.enable()
+        costs[exercise_type] = statistics.median(cost for cost, _ in runs)
+        relative[exercise_type] = statistics.median(cost / reference for cost, reference in runs)
+    try:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)['referenceRatio']
+    except (OSError, ValueError, KeyError):
+        baseline = {}
+
+    print()
+    for exercise_type, cost in costs.items():
+        line = f"{exercise_type:16} {cost * 1e6:7.1f} us/frame  {relative[exercise_type]:5.2f}x reference"
+        reference = baseline.get(exercise_type)
+        if reference:
+            change = relative[exercise_type] / reference - 1
+            line += f"  {change:+.0%} vs baseline"
+            if change > args.max_slowdown and not args.update_baseline:
+                failures.append(f"{exercise_type}: per-frame cost {change:+.0%} vs baseline")
+        print(line)
+
+    if args.update_baseline:
+        if failures:
+            print("\nNot updating the baseline: accuracy cases fail")
+        else:
+            with open(BASELINE_PATH, 'w') as f:
+                json.dump({'referenceRatio': relative}, f, indent=2, sort_keys=True)
+                f.write('\n')
+            print(f"\nBaseline written to {BASELINE_PATH}")
+
+    if failures:
+        print('\nFAILED:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+    print('\nAll cases passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import gc
+import os
+
+# Import the app once in the master and fork workers from it, so every worker
+# shares the interpreter, Flask and the app's modules copy-on-write
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Threads per worker: open result streams (/sessions/<id>/events) each hold one
+# for as long as they're open, so the app caps them at SSE_MAX_STREAMS (default
+# half of these) and frames keep being served while clients are subscribed
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+
+def on_starting(server):
+    """Keep the master's collector from touching (and un-sharing) its pages
+    between forks; collection is re-enabled in each worker after the fork"""
+    gc.disable()
+
+
+def when_ready(server):
+    """Import optional subsystems in the master before any worker is forked"""
+    if preload_app:
+        import app
+        app.warm_up()
+
+
+def pre_fork(server, worker):
+    """Move everything allocated so far out of the collector's reach"""
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Turn garbage collection back on in the worker"""
+    gc.enable()
+
+
+def post_worker_init(worker):
+    """Start the worker's snapshot, cluster and ring threads once it has loaded the app
+    (with or without preload)"""
+    import app
+    if app.SNAPSHOT_DIR:
+        app.start_snapshotting()
+    if app.CLUSTER_CONFIG:
+        app.start_cluster_watch()
+    if app.LANDMARK_RINGS:
+        app.start_ring_consumers()
+
+
+def worker_exit(server, worker):
+    """Drain: flush every changed session to the snapshot before the worker exits,
+    so its replacement (max_requests recycling, rolling deploy) picks them up"""
+    import app
+    if app.SNAPSHOT_DIR and app._snapshot_pid == os.getpid():
+        app.write_snapshot()
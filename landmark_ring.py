@@ -0,0 +1,180 @@
+"""Shared-memory ring buffer of pose frames for co-located producers.
+
+A pose estimator running on the same host writes frames straight into shared
+memory instead of POSTing JSON to /process_landmarks; the app (LANDMARK_RINGS)
+consumes them through the same per-session counting path. Each ring has one
+producer and one consumer. Slots are fixed size: a sequence number, the capture
+time, the session ID, the exercise type and 33 landmarks as float32
+x, y, z, visibility. The producer can fill a slot in place (reserve/commit) so
+model output is copied once, into the ring, and never serialized.
+
+Usage (benchmark): python landmark_ring.py [frames]
+"""
+import struct
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+MAGIC = b'LMRG'
+VERSION = 1
+LANDMARK_VALUES = 33 * 4  # x, y, z, visibility per landmark
+SESSION_BYTES = 64
+EXERCISE_BYTES = 32
+
+# Header: magic, version, slot count, slot size; the write and read indexes sit
+# on their own cache lines so producer and consumer don't contend
+HEADER = struct.Struct('<4sIII')
+WRITE_OFFSET = 64
+READ_OFFSET = 128
+HEADER_SIZE = 192
+INDEX = struct.Struct('<Q')
+
+# Slot: sequence number (index + 1 once committed), capture time in ms, session
+# ID and exercise type (NUL padded), then the landmark values
+SLOT_META = struct.Struct(f'<Qq{SESSION_BYTES}s{EXERCISE_BYTES}s')
+SLOT_SIZE = SLOT_META.size + LANDMARK_VALUES * 4
+
+
+class LandmarkRing:
+    """One end of a landmark ring; create() for the producer, attach() for the consumer"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, version, self.slots, slot_size = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION or slot_size != SLOT_SIZE:
+            raise ValueError(f"{shm.name} is not a version {VERSION} landmark ring")
+        # All slots' landmark values as float32, sliced per slot without copying
+        self.values = self.buf[HEADER_SIZE:].cast('f')
+        # Each side caches its own index and only reads the other's when it has to
+        self.write_index = INDEX.unpack_from(self.buf, WRITE_OFFSET)[0]
+        self.read_index = INDEX.unpack_from(self.buf, READ_OFFSET)[0]
+
+    @classmethod
+    def create(cls, name, slots=1024):
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + slots * SLOT_SIZE)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, slots, SLOT_SIZE)
+        INDEX.pack_into(shm.buf, WRITE_OFFSET, 0)
+        INDEX.pack_into(shm.buf, READ_OFFSET, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # The producer owns the segment: don't let this process's resource
+        # tracker unlink it when the consumer exits
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def slot_offset(self, index):
+        return HEADER_SIZE + (index % self.slots) * SLOT_SIZE
+
+    # Producer side
+
+    def reserve(self):
+        """Return the next free slot's landmark values (132 float32) to fill in place, or None if full"""
+        if self.write_index - self.read_index >= self.slots:
+            self.read_index = INDEX.unpack_from(self.buf, READ_OFFSET)[0]
+            if self.write_index - self.read_index >= self.slots:
+                return None
+        start = (self.slot_offset(self.write_index) + SLOT_META.size - HEADER_SIZE) // 4
+        return self.values[start:start + LANDMARK_VALUES]
+
+    def commit(self, session_id, exercise_type, timestamp_ms=None):
+        """Publish the reserved slot
+
+        IDs that don't fit their fields raise ValueError and the slot stays
+        reserved: truncating them could merge two sessions into one.
+        """
+        session_bytes = session_id.encode()
+        exercise_bytes = exercise_type.encode()
+        if len(session_bytes) > SESSION_BYTES or len(exercise_bytes) > EXERCISE_BYTES:
+            raise ValueError(f"session IDs are limited to {SESSION_BYTES} bytes and exercise types "
+                             f"to {EXERCISE_BYTES} bytes of UTF-8")
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        offset = self.slot_offset(self.write_index)
+        SLOT_META.pack_into(self.buf, offset, self.write_index + 1, timestamp_ms, session_bytes, exercise_bytes)
+        self.write_index += 1
+        # Publishing the index last makes the whole slot visible at once
+        INDEX.pack_into(self.buf, WRITE_OFFSET, self.write_index)
+
+    def write(self, session_id, exercise_type, values, timestamp_ms=None):
+        """Copy 132 landmark values into the ring; return False if it is full"""
+        slot = self.reserve()
+        if slot is None:
+            return False
+        with slot:
+            slot[:] = values if isinstance(values, memoryview) else memoryview(struct.pack(f'<{LANDMARK_VALUES}f', *values)).cast('f')
+        self.commit(session_id, exercise_type, timestamp_ms)
+        return True
+
+    # Consumer side
+
+    def read(self):
+        """Return (session ID, exercise type, capture ms, values) for the next frame, or None
+
+        The values view is only valid until release() frees the slot. A slot
+        that is out of sequence or whose IDs aren't UTF-8 raises ValueError;
+        release() skips it.
+        """
+        if self.read_index >= self.write_index:
+            self.write_index = INDEX.unpack_from(self.buf, WRITE_OFFSET)[0]
+            if self.read_index >= self.write_index:
+                return None
+        offset = self.slot_offset(self.read_index)
+        sequence, timestamp_ms, session_id, exercise_type = SLOT_META.unpack_from(self.buf, offset)
+        if sequence != self.read_index + 1:
+            raise ValueError(f"{self.shm.name}: slot {self.read_index} is out of sequence")
+        try:
+            session_id = session_id.rstrip(b'\0').decode()
+            exercise_type = exercise_type.rstrip(b'\0').decode()
+        except UnicodeDecodeError:
+            raise ValueError(f"{self.shm.name}: slot {self.read_index} has an undecodable session ID "
+                             f"or exercise type") from None
+        start = (offset + SLOT_META.size - HEADER_SIZE) // 4
+        return session_id, exercise_type, timestamp_ms, self.values[start:start + LANDMARK_VALUES]
+
+    def release(self):
+        """Free the slot returned by the last read()"""
+        self.read_index += 1
+        INDEX.pack_into(self.buf, READ_OFFSET, self.read_index)
+
+    def pending(self):
+        """Frames written but not yet consumed"""
+        return INDEX.unpack_from(self.buf, WRITE_OFFSET)[0] - INDEX.unpack_from(self.buf, READ_OFFSET)[0]
+
+    def close(self):
+        """Detach (views handed out by reserve() and read() must be released first)"""
+        self.values.release()
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    source = memoryview(struct.pack(f'<{LANDMARK_VALUES}f', *[0.5] * LANDMARK_VALUES)).cast('f')
+    producer = LandmarkRing.create(f'landmark_ring_bench_{int(time.time())}', slots=1024)
+    # Constructed directly: attach() would untrack the segment this process created
+    consumer = LandmarkRing(shared_memory.SharedMemory(name=producer.shm.name), owner=False)
+    try:
+        start = time.perf_counter()
+        for _ in range(frames):
+            with producer.reserve() as slot:
+                slot[:] = source
+            producer.commit('bench', 'bicepCurl')
+            with consumer.read()[3] as values:
+                values.tolist()
+            consumer.release()
+        elapsed = time.perf_counter() - start
+        print(f"{frames} frames written and read in {elapsed:.2f} s ({elapsed / frames * 1e6:.1f} us/frame)")
+    finally:
+        consumer.close()
+        producer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Local load generator for /process_landmarks.
+
+Simulates clients streaming synthetic bicep-curl frames at a fixed frame rate
+and reports throughput, latency percentiles and response codes. Like the web
+client, each simulated client slows down to the server's advised frame rate
+(X-Advised-FPS) while it is overloaded; the report shows how many responses
+were degraded. Frames carry X-Request-Start, which a server started with
+TRUST_REQUEST_START=1 reads as queue time; otherwise its overload control goes
+by how many of its threads are busy.
+
+With --json, clients post application/json like the pre-text/plain web client
+and send the CORS preflight a browser would, cached for Access-Control-Max-Age
+(5 s when absent, as in Chromium, capped at 2 h), so preflight overhead can be
+compared.
+
+Usage: python loadgen.py [--url URL] [--clients N] [--fps F] [--seconds S] [--push] [--json]
+"""
+import argparse
+import http.client
+import json
+import math
+import threading
+import time
+import urllib.parse
+
+# Origin sent with emulated preflights, as a page served elsewhere would
+PAGE_ORIGIN = 'https://frontend.example'
+
+# Browsers cache a preflight this long when the response has no max age, and no
+# longer than the cap whatever it says (Chromium's values)
+DEFAULT_PREFLIGHT_CACHE = 5
+MAX_PREFLIGHT_CACHE = 7200
+
+
+def make_frame(t):
+    """Build a 33-landmark frame with both elbows curling at 0.5 Hz"""
+    angle = math.radians(100 + 70 * math.cos(math.pi * t))
+    landmarks = [{'x': 0.5, 'y': 0.5, 'z': 0.0, 'visibility': 0.99} for _ in range(33)]
+    for shoulder, elbow, wrist, x in ((11, 13, 15, 0.4), (12, 14, 16, 0.6)):
+        landmarks[shoulder] = {'x': x, 'y': 0.3, 'z': 0.0, 'visibility': 0.99}
+        landmarks[elbow] = {'x': x, 'y': 0.5, 'z': 0.0, 'visibility': 0.99}
+        landmarks[wrist] = {'x': x + 0.2 * math.sin(angle), 'y': 0.5 - 0.2 * math.cos(angle),
+                            'z': 0.0, 'visibility': 0.99}
+    return landmarks
+
+
+def send_preflight(connection, path):
+    """Send a browser's CORS preflight for a JSON POST; return seconds it may be cached"""
+    connection.request('OPTIONS', path, headers={
+        'Origin': PAGE_ORIGIN,
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'content-type'
+    })
+    response = connection.getresponse()
+    response.read()
+    max_age = response.getheader('Access-Control-Max-Age')
+    return min(int(max_age), MAX_PREFLIGHT_CACHE) if max_age else DEFAULT_PREFLIGHT_CACHE
+
+
+def run_client(url, client_id, fps, seconds, results, lock, push=False, json_body=False):
+    """Stream frames for one simulated client, recording latency and status"""
+    parsed = urllib.parse.urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=10)
+    session_id = f'loadgen_{client_id}_{int(time.time())}'
+    path = f'/process_landmarks?sessionId={session_id}' + ('&push=1' if push else '')
+    interval = 1.0 / fps
+    start = time.perf_counter()
+    next_frame = start
+    preflight_until = start
+
+    while time.perf_counter() - start < seconds:
+        body = json.dumps({
+            'landmarks': make_frame(time.perf_counter() - start),
+            'exerciseType': 'bicepCurl',
+            'sessionId': session_id
+        })
+        sent = time.perf_counter()
+        advised = None
+        try:
+            if json_body and sent >= preflight_until:
+                preflight_until = sent + send_preflight(connection, path)
+                with lock:
+                    results['preflights'] += 1
+            connection.request('POST', path, body, {
+                'Content-Type': 'application/json' if json_body else 'text/plain;charset=UTF-8',
+                'X-Request-Start': f't={int(time.time() * 1000)}'
+            })
+            response = connection.getresponse()
+            payload = response.read()
+            status = response.status
+            advised = response.getheader('X-Advised-FPS')
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            payload, status = b'', 'error'
+        latency = time.perf_counter() - sent
+
+        with lock:
+            results['latencies'].append(latency)
+            results['statuses'][status] = results['statuses'].get(status, 0) + 1
+            if status == 200:
+                results['last'][client_id] = payload
+                if b'"angles"' not in payload:
+                    results['lean'] += 1
+            if advised:
+                results['advised'][advised] = results['advised'].get(advised, 0) + 1
+
+        next_frame += 1.0 / min(fps, float(advised)) if advised else interval
+        delay = next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def percentile(sorted_values, fraction):
+    """Return the value at a fraction of a sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--push', action='store_true', help='post frames in push mode (204, results via events)')
+    parser.add_argument('--json', action='store_true',
+                        help='post application/json with browser-style CORS preflights')
+    args = parser.parse_args()
+
+    results = {'latencies': [], 'statuses': {}, 'last': {}, 'lean': 0, 'advised': {}, 'preflights': 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_client,
+                         args=(args.url, i, args.fps, args.seconds, results, lock, args.push, args.json))
+        for i in range(args.clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(results['latencies'])
+    print(f"requests: {len(latencies)} in {elapsed:.1f} s ({len(latencies) / elapsed:.0f} req/s)")
+    print(f"latency ms: p50 {percentile(latencies, 0.5) * 1000:.1f}, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f}, p99 {percentile(latencies, 0.99) * 1000:.1f}")
+    print(f"status codes: {results['statuses']}")
+    print(f"preflights: {results['preflights']} for {len(latencies)} POSTs")
+    print(f"degraded: {results['lean']} responses without angles, advised fps {results['advised'] or 'never'}")
+
+
+if __name__ == '__main__':
+    main()
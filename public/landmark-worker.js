@@ -0,0 +1,120 @@
+// Web Worker that owns serialization and network I/O for landmark frames.
+// The main thread posts packed frames; at most one request is in flight and
+// frames arriving meanwhile are coalesced so only the latest one is sent.
+// In push mode the empty responses are ignored, since results arrive over the
+// session's event stream instead. Push mode still keeps one frame in flight:
+// frames that overlap would race each other and arrive out of order. While
+// the server is overloaded it advises a lower frame rate (X-Advised-FPS), and
+// frames are sent no faster than that until it stops.
+
+const VALUES_PER_LANDMARK = 4; // x, y, z, visibility
+
+let backendUrl = '';
+let sessionId = '';
+let pushMode = false;
+let inFlight = 0;
+let pendingFrame = null;
+let retryAt = 0;
+let minSendInterval = 0;
+let lastSentAt = 0;
+let throttleTimer = null;
+
+self.onmessage = (event) => {
+    const message = event.data;
+
+    if (message.type === 'config') {
+        backendUrl = message.backendUrl;
+        sessionId = message.sessionId;
+        pushMode = message.pushMode;
+    } else if (message.type === 'frame') {
+        // Replace any frame still waiting: an older frame is no longer worth sending
+        pendingFrame = message;
+        send_next_frame();
+    } else if (message.type === 'reset') {
+        pendingFrame = null;
+    }
+};
+
+function unpack_landmarks(packed) {
+    const landmarks = new Array(packed.length / VALUES_PER_LANDMARK);
+    for (let i = 0, j = 0; i < landmarks.length; i++, j += VALUES_PER_LANDMARK) {
+        landmarks[i] = {
+            x: packed[j],
+            y: packed[j + 1],
+            z: packed[j + 2],
+            visibility: packed[j + 3]
+        };
+    }
+    return landmarks;
+}
+
+async function send_next_frame() {
+    if (inFlight >= 1 || !pendingFrame) {
+        return;
+    }
+
+    // Honour Retry-After from the server by dropping frames until it has passed
+    if (Date.now() < retryAt) {
+        pendingFrame = null;
+        return;
+    }
+
+    // Keep the latest frame and send it once the advised frame interval has passed
+    const wait = lastSentAt + minSendInterval - Date.now();
+    if (wait > 0) {
+        if (!throttleTimer) {
+            throttleTimer = setTimeout(() => {
+                throttleTimer = null;
+                send_next_frame();
+            }, wait);
+        }
+        return;
+    }
+
+    const frame = pendingFrame;
+    pendingFrame = null;
+    lastSentAt = Date.now();
+    inFlight++;
+
+    try {
+        const body = JSON.stringify({
+            landmarks: unpack_landmarks(new Float32Array(frame.buffer)),
+            exerciseType: frame.exerciseType,
+            sessionId: sessionId
+        });
+
+        // text/plain keeps this a CORS "simple" request (no preflight); sessionId in
+        // the query string lets the server rate limit before parsing the body
+        const push = pushMode ? '&push=1' : '';
+        const response = await fetch(`${backendUrl}/process_landmarks?sessionId=${encodeURIComponent(sessionId)}${push}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'text/plain;charset=UTF-8',
+            },
+            body: body,
+            mode: 'cors',
+            keepalive: pushMode
+        });
+
+        if (response.status === 429) {
+            const retryAfter = parseInt(response.headers.get('Retry-After') || '1', 10);
+            retryAt = Date.now() + retryAfter * 1000;
+            throw new Error(`Rate limited, retrying in ${retryAfter}s`);
+        }
+        if (!response.ok) {
+            throw new Error(`Server responded with status: ${response.status}`);
+        }
+
+        const advisedFps = parseFloat(response.headers.get('X-Advised-FPS'));
+        minSendInterval = advisedFps > 0 ? 1000 / advisedFps : 0;
+
+        if (!pushMode) {
+            self.postMessage({ type: 'result', result: await response.json() });
+        }
+    } catch (error) {
+        self.postMessage({ type: 'error', message: error.message });
+    } finally {
+        inFlight--;
+        send_next_frame();
+    }
+}
@@ -1,3 +1,18 @@
+// Client-side rep detection used to count optimistically in push mode: the
+// averaged joint angle must pass `reset` and then `count` (in the direction
+// given by `countBelow`). Mirrors the server's thresholds; the server's rep
+// events stay authoritative.
+const OPTIMISTIC_RULES = {
+    bicepCurl: { joints: [[11, 13, 15], [12, 14, 16]], count: 50, reset: 140, countBelow: true },
+    tricepExtension: { joints: [[11, 13, 15], [12, 14, 16]], count: 140, reset: 100, countBelow: false },
+    pushup: { joints: [[11, 13, 15], [12, 14, 16]], count: 90, reset: 160, countBelow: true },
+    shoulderPress: { joints: [[15, 13, 11], [16, 14, 12]], count: 140, reset: 120, countBelow: false },
+    squat: { joints: [[23, 25, 27], [24, 26, 28]], count: 125, reset: 160, countBelow: true }
+};
+
+// Optimistic reps not confirmed by the server within this time are rolled back
+const OPTIMISTIC_CONFIRM_MS = 2000;
+
 class ExerciseCounter {
     constructor() {
         // Cache DOM elements
@@ -19,14 +34,14 @@ class ExerciseCounter {
         this.sessionId = 'user_' + Math.random().toString(36).substr(2, 9) + '_' + Date.now();
         console.log("Session ID created:", this.sessionId);
         
-        // Backend URL
-        this.backendUrl = "https://render-chatbot1-a8hc.onrender.com";
+        // Backend URL (empty when the page is served by the backend itself)
+        const backendMeta = document.querySelector('meta[name="backend-url"]');
+        this.backendUrl = backendMeta ? backendMeta.content : "https://render-chatbot1-a8hc.onrender.com";
 
         // Inactivity tracking
         this.lastActivityTime = Date.now();
         this.inactivityTimeout = 180000; // 3 minutes 
         this.inactivityTimer = null;
-        this.lastLandmarks = null;
         this.noMovementFrames = 0;
         this.movementThreshold = 0.05; // Threshold for detecting movement
         this.maxNoMovementFrames = 150;
@@ -34,6 +49,31 @@ class ExerciseCounter {
         // Key points for movement detection (optimization)
         this.keyPoints = [0, 11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28]; // Head, shoulders, arms, hips, legs
 
+        // Previous x/y of the key points, reused every frame instead of deep-copying landmarks
+        this.lastKeyPoints = new Float32Array(this.keyPoints.length * 2);
+        this.hasLastKeyPoints = false;
+
+        // Push mode: frames are fired without waiting for results, which arrive as
+        // events over a Server-Sent Events stream; reps are counted optimistically
+        const modeMeta = document.querySelector('meta[name="result-mode"]');
+        this.pushMode = modeMeta !== null && modeMeta.content === 'push';
+        this.pendingReps = [];
+        this.optimisticArmed = false;
+
+        // Serialization and network I/O run in a Web Worker, which keeps at most
+        // one request in flight and coalesces frames to the latest one
+        this.landmarkWorker = new Worker('landmark-worker.js');
+        this.landmarkWorker.onmessage = this.handle_worker_message.bind(this);
+        this.landmarkWorker.postMessage({
+            type: 'config',
+            backendUrl: this.backendUrl,
+            sessionId: this.sessionId,
+            pushMode: this.pushMode
+        });
+        if (this.pushMode) {
+            this.open_event_stream();
+        }
+
         // Setup canvas size responsively
         this.resize_canvas();
         window.addEventListener('resize', this.resize_canvas.bind(this));
@@ -55,9 +95,13 @@ class ExerciseCounter {
 
     handle_exercise_change() {
         console.log("Exercise changed to:", this.exerciseSelector.value);
+        // Drop any frame of the previous exercise that is still waiting to be sent
+        this.landmarkWorker.postMessage({ type: 'reset' });
         this.repCounter = 0;
         this.repDisplay.innerText = '0';
         this.stage = "down";
+        this.pendingReps = [];
+        this.optimisticArmed = false;
         
         if (this.feedbackDisplay) {
             this.feedbackDisplay.innerText = '';
@@ -179,34 +223,40 @@ class ExerciseCounter {
             // Check for movement
             this.detect_movement(results.poseLandmarks);
 
+            if (this.pushMode) {
+                this.count_optimistically(results.poseLandmarks);
+            }
+
             // Send landmarks to backend for processing
             this.send_landmarks_to_backend(results.poseLandmarks);
         }
     }
 
     detect_movement(landmarks) {
-        // If no previous landmarks, store current ones and return
-        if (!this.lastLandmarks) {
-            this.lastLandmarks = JSON.parse(JSON.stringify(landmarks));
-            return;
-        }
-
         // Check if there's significant movement between frames
         let movement = false;
+        const threshold = this.movementThreshold * this.movementThreshold;
         
-        // Check key landmarks for movement
-        for (const i of this.keyPoints) {
-            if (landmarks[i] && this.lastLandmarks[i]) {
-                const dx = landmarks[i].x - this.lastLandmarks[i].x;
-                const dy = landmarks[i].y - this.lastLandmarks[i].y;
+        // Check key landmarks for movement, storing their positions for the next frame
+        for (let k = 0; k < this.keyPoints.length; k++) {
+            const point = landmarks[this.keyPoints[k]];
+            if (!point) {
+                continue;
+            }
+            if (this.hasLastKeyPoints && !movement) {
+                const dx = point.x - this.lastKeyPoints[2 * k];
+                const dy = point.y - this.lastKeyPoints[2 * k + 1];
                 // Using square of distance to avoid expensive square root operation
-                const distanceSquared = dx*dx + dy*dy;
-                
-                if (distanceSquared > this.movementThreshold * this.movementThreshold) {
-                    movement = true;
-                    break;
-                }
+                movement = dx*dx + dy*dy > threshold;
             }
+            this.lastKeyPoints[2 * k] = point.x;
+            this.lastKeyPoints[2 * k + 1] = point.y;
+        }
+
+        // If no previous landmarks, the current ones are now stored
+        if (!this.hasLastKeyPoints) {
+            this.hasLastKeyPoints = true;
+            return;
         }
 
         // Update movement counter
@@ -221,49 +271,149 @@ class ExerciseCounter {
                 this.check_inactivity();
             }
         }
-
-        // Store current landmarks for next comparison
-        this.lastLandmarks = JSON.parse(JSON.stringify(landmarks));
     }
 
-    async send_landmarks_to_backend(landmarks) {
-        try {
-            // Prepare the data to send
-            const data = {
-                landmarks: landmarks,
-                exerciseType: this.exerciseSelector.value,
-                sessionId: this.sessionId
-            };
+    send_landmarks_to_backend(landmarks) {
+        // Pack the frame into a typed array and transfer it to the worker without copying
+        const packed = new Float32Array(landmarks.length * 4);
+        for (let i = 0, j = 0; i < landmarks.length; i++, j += 4) {
+            const point = landmarks[i];
+            packed[j] = point.x;
+            packed[j + 1] = point.y;
+            packed[j + 2] = point.z || 0;
+            packed[j + 3] = point.visibility === undefined ? 1 : point.visibility;
+        }
 
-            // Send the data to the backend
-            const response = await fetch(`${this.backendUrl}/process_landmarks`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(data),
-                mode: 'cors'
-            });
+        this.landmarkWorker.postMessage({
+            type: 'frame',
+            buffer: packed.buffer,
+            exerciseType: this.exerciseSelector.value
+        }, [packed.buffer]);
+    }
 
-            if (!response.ok) {
-                throw new Error(`Server responded with status: ${response.status}`);
-            }
+    handle_worker_message(event) {
+        const message = event.data;
+
+        if (message.type === 'result') {
+            const result = message.result;
 
-            // Process the response
-            const result = await response.json();
-            
             // If exercise is being performed (rep count increases), reset inactivity
             if (result.repCounter !== undefined && this.repCounter !== result.repCounter) {
                 this.reset_inactivity_timer();
             }
-            
+
             this.update_ui_from_response(result);
-        } catch (error) {
-            console.error('Error sending landmarks to backend:', error);
-            // Handle error appropriately
+        } else if (message.type === 'error') {
+            console.error('Error sending landmarks to backend:', message.message);
             if (this.feedbackDisplay) {
-                this.feedbackDisplay.innerText = `Connection error: ${error.message}`;
+                this.feedbackDisplay.innerText = `Connection error: ${message.message}`;
+            }
+        }
+    }
+
+    open_event_stream() {
+        // EventSource reconnects by itself, resuming from the last event it saw
+        const url = `${this.backendUrl}/sessions/${encodeURIComponent(this.sessionId)}/events`;
+        this.eventSource = new EventSource(url);
+
+        // A refused stream (the server is at its stream limit) isn't retried:
+        // go back to reading results from the frame responses
+        this.eventSource.addEventListener('error', () => {
+            if (this.eventSource.readyState === EventSource.CLOSED) {
+                this.pushMode = false;
+                this.pendingReps = [];
+                this.landmarkWorker.postMessage({
+                    type: 'config',
+                    backendUrl: this.backendUrl,
+                    sessionId: this.sessionId,
+                    pushMode: false
+                });
             }
+        });
+
+        this.eventSource.addEventListener('rep', (event) => {
+            const data = JSON.parse(event.data);
+            if (data.exerciseType !== this.exerciseSelector.value) {
+                return;
+            }
+            // The server's count is authoritative; it confirms the oldest optimistic rep
+            this.repCounter = data.repCounter;
+            this.pendingReps.shift();
+            this.render_rep_count();
+            this.reset_inactivity_timer();
+        });
+
+        this.eventSource.addEventListener('stage', (event) => {
+            const data = JSON.parse(event.data);
+            if (data.exerciseType === this.exerciseSelector.value) {
+                this.stage = data.stage;
+            }
+        });
+
+        this.eventSource.addEventListener('feedback', (event) => {
+            if (this.feedbackDisplay) {
+                this.feedbackDisplay.innerText = JSON.parse(event.data).feedback;
+            }
+        });
+
+        this.eventSource.addEventListener('warning', (event) => {
+            const warnings = JSON.parse(event.data).warnings;
+            if (warnings.length && this.feedbackDisplay) {
+                this.feedbackDisplay.innerText = warnings.join(' ');
+            }
+        });
+    }
+
+    count_optimistically(landmarks) {
+        // Roll back optimistic reps the server never confirmed
+        const now = Date.now();
+        const unconfirmed = this.pendingReps.length;
+        this.pendingReps = this.pendingReps.filter((time) => now - time < OPTIMISTIC_CONFIRM_MS);
+
+        const rule = OPTIMISTIC_RULES[this.exerciseSelector.value];
+        let angle = null;
+        if (rule) {
+            let total = 0;
+            let count = 0;
+            for (const [a, b, c] of rule.joints) {
+                if (landmarks[a].visibility > 0.5 && landmarks[b].visibility > 0.5 && landmarks[c].visibility > 0.5) {
+                    total += this.joint_angle(landmarks[a], landmarks[b], landmarks[c]);
+                    count++;
+                }
+            }
+            angle = count ? total / count : null;
+        }
+
+        if (angle !== null) {
+            const pastCount = rule.countBelow ? angle < rule.count : angle > rule.count;
+            const pastReset = rule.countBelow ? angle > rule.reset : angle < rule.reset;
+            if (pastReset) {
+                this.optimisticArmed = true;
+            } else if (pastCount && this.optimisticArmed) {
+                this.optimisticArmed = false;
+                this.pendingReps.push(now);
+            }
+        }
+
+        if (this.pendingReps.length !== unconfirmed || angle !== null) {
+            this.render_rep_count();
+        }
+    }
+
+    joint_angle(a, b, c) {
+        // Angle at b in degrees, as computed by the server
+        const radians = Math.atan2(c.y - b.y, c.x - b.x) - Math.atan2(a.y - b.y, a.x - b.x);
+        let angle = Math.abs(radians * 180 / Math.PI);
+        if (angle > 180) {
+            angle = 360 - angle;
+        }
+        return angle;
+    }
+
+    render_rep_count() {
+        const shown = String(this.repCounter + this.pendingReps.length);
+        if (this.repDisplay.innerText !== shown) {
+            this.repDisplay.innerText = shown;
         }
     }
 
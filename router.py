@@ -0,0 +1,221 @@
+"""Local routing proxy that sends each session's traffic to the node owning it.
+
+Reads the same cluster config as the app (CLUSTER_CONFIG, see sharding.py) and
+reloads it when it changes. Frames are routed by the sessionId in the query
+string (or, failing that, the JSON body); /sessions/<id>/... by the path, with
+event streams relayed as they arrive. When a node answers 421 (its view of the
+ring is newer) the router reloads the config and retries once at the node it
+named. Run the nodes with TRUST_REQUEST_START=1: the router always sets
+X-Request-Start, so their overload control sees time queued here.
+
+Usage: python router.py --config cluster.json [--port 8080]
+"""
+import argparse
+import http.client
+import http.server
+import json
+import os
+import select
+import threading
+import time
+import urllib.parse
+
+import sharding
+
+# Hop-by-hop headers are not forwarded
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+               'proxy-authorization', 'proxy-authenticate'}
+
+
+class Cluster:
+    """The current ring, reloaded when the config file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.nodes = []
+        self.ring = ([], [])
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        with self.lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                return
+            if mtime == self.mtime:
+                return
+            try:
+                nodes = sharding.load_cluster_nodes(self.path)
+            except (OSError, ValueError, AttributeError) as e:
+                print(f"router: not reloading {self.path}: {e}")
+                return
+            self.mtime = mtime
+            self.ring = sharding.build_ring(nodes)
+            self.nodes = nodes
+
+    def node_for(self, session_id):
+        if session_id is None:
+            # Requests without a session can go anywhere
+            return self.nodes[0] if self.nodes else None
+        return sharding.ring_node(self.ring, session_id)
+
+
+def connection_closed(connection):
+    """Check whether the node has closed an idle keep-alive connection"""
+    if connection.sock is None:
+        return False
+    # An idle connection only becomes readable when the node closes it
+    readable, _, _ = select.select([connection.sock], [], [], 0)
+    return bool(readable)
+
+
+class RouterHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cluster = None
+    local = threading.local()
+
+    def do_GET(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+    def do_OPTIONS(self):
+        self.route()
+
+    def log_message(self, format, *args):
+        pass
+
+    def session_id(self, body):
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        if 'sessionId' in query:
+            return query['sessionId'][0]
+        parts = parsed.path.strip('/').split('/')
+        if len(parts) >= 2 and parts[0] == 'sessions':
+            return urllib.parse.unquote(parts[1])
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return None
+            if isinstance(data, dict) and isinstance(data.get('sessionId'), str):
+                return data['sessionId']
+        return None
+
+    def route(self):
+        self.received_ms = int(time.time() * 1000)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        self.cluster.reload()
+        node = self.cluster.node_for(self.session_id(body))
+        if node is None:
+            self.reply(503, {}, b'{"error":"No nodes configured"}')
+            return
+
+        status, headers, payload = self.forward(node, body)
+        if status == 421:
+            # The node has a newer ring than ours: catch up and follow its answer
+            self.cluster.reload()
+            owner = headers.get('x-shard-node')
+            if owner:
+                status, headers, payload = self.forward(owner, body)
+        if isinstance(payload, http.client.HTTPResponse):
+            self.relay_stream(status, headers, payload)
+        else:
+            self.reply(status, headers, payload)
+
+    def forward(self, node, body):
+        """Send the request to a node over a reused per-thread connection"""
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        headers = {k: v for k, v in self.headers.items()
+                   if k.lower() not in HOP_HEADERS and k.lower() not in ('x-forwarded-for', 'x-request-start')}
+        # Append, as other proxies do, so the app can count trusted hops from the right
+        forwarded = self.headers.get('X-Forwarded-For')
+        headers['X-Forwarded-For'] = (f'{forwarded}, ' if forwarded else '') + self.client_address[0]
+        # Let nodes measure how long requests queued here (overload control). Always
+        # replaced, so nodes can trust it (TRUST_REQUEST_START=1)
+        headers['X-Request-Start'] = f't={self.received_ms}'
+
+        for attempt in range(2):
+            connection = connections.get(node)
+            if connection is not None and connection_closed(connection):
+                # The node closed this idle keep-alive connection: don't send on it
+                connection.close()
+                connection = None
+            if connection is None:
+                parsed = urllib.parse.urlparse(node)
+                connection = connections[node] = http.client.HTTPConnection(
+                    parsed.hostname, parsed.port or 80, timeout=10)
+            try:
+                connection.request(self.command, self.path, body, headers)
+                response = connection.getresponse()
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+                if response_headers.get('content-type', '').startswith('text/event-stream'):
+                    # Streams are relayed as they arrive over their own connection,
+                    # which idles between events for longer than the request timeout
+                    del connections[node]
+                    connection.sock.settimeout(None)
+                    return response.status, response_headers, response
+                return response.status, response_headers, response.read()
+            except ConnectionRefusedError:
+                # Nothing was sent, so trying again can't count a frame twice
+                connection.close()
+                del connections[node]
+            except (OSError, http.client.HTTPException):
+                # The node may have processed the request (e.g. a read timeout)
+                connection.close()
+                del connections[node]
+                break
+        return 502, {}, b'{"error":"Node unreachable"}'
+
+    def relay_stream(self, status, headers, response):
+        """Copy an event stream to the client until either side closes it"""
+        self.send_response(status)
+        for name, value in headers.items():
+            if name not in HOP_HEADERS and name != 'content-length':
+                self.send_header(name, value)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            response.close()
+
+    def reply(self, status, headers, payload):
+        self.send_response(status)
+        for name, value in headers.items():
+            if name not in HOP_HEADERS and name != 'content-length':
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default=os.environ.get('CLUSTER_CONFIG', 'cluster.json'))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)))
+    args = parser.parse_args()
+
+    RouterHandler.cluster = Cluster(args.config)
+    server = http.server.ThreadingHTTPServer((args.host, args.port), RouterHandler)
+    print(f"router: {len(RouterHandler.cluster.nodes)} nodes, listening on {args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
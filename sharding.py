@@ -0,0 +1,48 @@
+"""Consistent hashing of session IDs onto cluster nodes.
+
+Shared by the app (to reject frames for sessions it doesn't own and to hand
+sessions off when membership changes) and by router.py. Each node is placed on
+the ring at VNODES points, so adding or removing a node only moves the sessions
+adjacent to its points instead of reshuffling every session.
+
+The cluster config is a JSON file: {"nodes": ["http://host:port", ...]}
+"""
+import bisect
+import hashlib
+import json
+import urllib.parse
+
+VNODES = 64
+
+
+def ring_hash(key):
+    """Hash a string to a point on the ring"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def build_ring(nodes, vnodes=VNODES):
+    """Build a ring as (sorted points, owning node per point)"""
+    points = sorted((ring_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(vnodes))
+    return [point for point, _ in points], [node for _, node in points]
+
+
+def ring_node(ring, key):
+    """Return the node that owns a key, or None for an empty ring"""
+    points, nodes = ring
+    if not points:
+        return None
+    index = bisect.bisect(points, ring_hash(key))
+    return nodes[index % len(nodes)]
+
+
+def load_cluster_nodes(path):
+    """Read the node list from a cluster config file"""
+    with open(path) as f:
+        nodes = json.load(f).get('nodes', [])
+    if not isinstance(nodes, list) or not all(isinstance(node, str) for node in nodes):
+        raise ValueError("'nodes' must be a list of base URLs")
+    for node in nodes:
+        parsed = urllib.parse.urlparse(node)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise ValueError(f"node {node!r} is not an http(s)://host[:port] URL")
+    return [node.rstrip('/') for node in nodes]
@@ -0,0 +1,19 @@
+"""Admin token checks for the debug and admin endpoints."""
+import app
+
+
+def test_admin_routes_take_the_token_from_the_header_only(monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'admin-secret')
+    client = app.app.test_client()
+    assert client.get('/debug/costs', headers={'X-Admin-Token': 'admin-secret'}).status_code == 200
+    assert client.get('/debug/costs', headers={'X-Admin-Token': 'admin-secreT'}).status_code == 403
+    assert client.get('/debug/costs', headers={'X-Admin-Token': 'é'}).status_code == 403
+    # The query string ends up in access logs: not accepted
+    assert client.get('/debug/costs?token=admin-secret').status_code == 403
+
+
+def test_admin_routes_are_hidden_without_a_token(monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', None)
+    client = app.app.test_client()
+    assert client.get('/debug/costs', headers={'X-Admin-Token': 'anything'}).status_code == 404
+    assert not app.admin_token_valid('anything')
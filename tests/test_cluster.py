@@ -0,0 +1,194 @@
+"""Sharding and handoff: three local nodes behind router.py, with nodes added and removed mid-workout."""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+import app
+import golden_harness
+import sharding
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSIONS = 12
+TOKEN = 'cluster-test'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def request(url, body=None, token=None):
+    headers = {'Content-Type': 'text/plain;charset=UTF-8'}
+    if token:
+        headers['X-Admin-Token'] = token
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=10) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'null')
+
+
+def write_config(path, nodes):
+    with open(path, 'w') as f:
+        json.dump({'nodes': nodes}, f)
+    # Make sure the change is visible even within one mtime tick
+    stamp = time.time() + write_config.bumps
+    write_config.bumps += 1
+    os.utime(path, (stamp, stamp))
+
+
+write_config.bumps = 1
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    config = str(tmp_path / 'cluster.json')
+    nodes = [f'http://127.0.0.1:{free_port()}' for _ in range(3)]
+    write_config(config, nodes[:2])
+    processes = []
+    env = dict(os.environ, CLUSTER_CONFIG=config, CLUSTER_RELOAD_INTERVAL='0.2', ADMIN_TOKEN=TOKEN,
+               TRUST_REQUEST_START='1', RATE_LIMIT_IP_RPS='100000', RATE_LIMIT_IP_BURST='100000', RATE_LIMIT_SESSION_RPS='100000',
+               RATE_LIMIT_SESSION_BURST='100000', NEW_SESSIONS_PER_MINUTE='100000')
+    try:
+        for node in nodes:
+            processes.append(subprocess.Popen(
+                [sys.executable, 'app.py'], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                env=dict(env, PORT=node.rsplit(':', 1)[1], NODE_URL=node)))
+        router = f'http://127.0.0.1:{free_port()}'
+        processes.append(subprocess.Popen(
+            [sys.executable, 'router.py', '--config', config, '--port', router.rsplit(':', 1)[1]],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for url in nodes + [router]:
+            wait_for(url + '/shards')
+        yield config, nodes, router
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def post_frames(router, frames):
+    for session_id in range(SESSIONS):
+        sid = f'cluster_{session_id}'
+        for _, landmarks in frames:
+            status, _ = request(f'{router}/process_landmarks?sessionId={sid}',
+                                {'landmarks': landmarks, 'exerciseType': 'bicepCurl', 'sessionId': sid})
+            assert status == 200
+
+
+def node_sessions(node):
+    return request(f'{node}/health')[1]['sessions']
+
+
+def test_reps_survive_nodes_joining_and_leaving(cluster):
+    config, nodes, router = cluster
+    frames, labels, _ = golden_harness.build_case('bicepCurl', 'clean10')
+    third = len(frames) // 3
+
+    post_frames(router, frames[:third])
+    write_config(config, nodes)  # A node joins: sessions it now owns move to it
+    time.sleep(1.5)
+    post_frames(router, frames[third:2 * third])
+    write_config(config, [nodes[0], nodes[2]])  # A node leaves: it drains
+    time.sleep(1.5)
+    post_frames(router, frames[2 * third:])
+
+    assert node_sessions(nodes[1]) == 0
+    assert sum(node_sessions(node) for node in nodes) == SESSIONS
+    for session_id in range(SESSIONS):
+        status, summary = request(f'{router}/sessions/cluster_{session_id}/summary')
+        assert status == 200
+        assert summary['totalReps'] == len(labels)
+        assert summary['frames'] == len(frames)
+
+
+def test_handoff_merges_reps_counted_mid_handoff():
+    old = {'repCounter': 3, 'stage': 'down', 'exerciseType': 'bicepCurl'}
+    old_summary = {'startedAt': 1000, 'lastSeen': 5000, 'frames': 90, 'skippedFrames': 0, 'activeMs': 4000,
+                   'totalReps': 3, 'repsByExercise': {'bicepCurl': 3}}
+    # Frames routed here before the handoff arrived started a fresh copy
+    app.exercise_states['merge_bicepCurl'] = {'repCounter': 1, 'stage': 'up', 'exerciseType': 'bicepCurl'}
+    app.session_summaries['merge'] = {'startedAt': 5100, 'lastSeen': 6000, 'frames': 30, 'skippedFrames': 0,
+                                      'activeMs': 900, 'totalReps': 1, 'repsByExercise': {'bicepCurl': 1}}
+    try:
+        assert app.accept_handoff({'merge_bicepCurl': old}, {'merge': old_summary}) == 1
+        state = app.exercise_states['merge_bicepCurl']
+        summary = app.session_summaries['merge']
+        assert state['repCounter'] == 4
+        assert state['stage'] == 'up'  # The newer copy keeps its state machine
+        assert summary['totalReps'] == 4
+        assert summary['frames'] == 120
+        assert (summary['startedAt'], summary['lastSeen']) == (1000, 6000)
+
+        # A retried handoff of the same history doesn't add the reps again
+        app.accept_handoff({'merge_bicepCurl': dict(old)}, {'merge': dict(old_summary, startedAt=1000)})
+        assert app.exercise_states['merge_bicepCurl']['repCounter'] == 4
+    finally:
+        app.exercise_states.pop('merge_bicepCurl', None)
+        app.session_summaries.pop('merge', None)
+
+
+def test_node_urls_need_a_scheme_and_host(tmp_path):
+    path = tmp_path / 'cluster.json'
+    path.write_text(json.dumps({'nodes': ['http://10.0.0.1:5000', 'localhost:5000']}))
+    with pytest.raises(ValueError):
+        sharding.load_cluster_nodes(str(path))
+    path.write_text(json.dumps({'nodes': ['http://10.0.0.1:5000/', 'https://node.example']}))
+    assert sharding.load_cluster_nodes(str(path)) == ['http://10.0.0.1:5000', 'https://node.example']
+
+
+def test_empty_ring_hands_nothing_off(monkeypatch):
+    monkeypatch.setattr(app, 'shard_ring', sharding.build_ring([]))
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', TOKEN)
+    app.session_summaries['handoff_empty'] = {'startedAt': 0, 'lastSeen': 0, 'frames': 0, 'skippedFrames': 0,
+                                              'activeMs': 0, 'totalReps': 0, 'repsByExercise': {}}
+    try:
+        assert app.hand_off_sessions() is True
+        assert 'handoff_empty' in app.session_summaries
+    finally:
+        app.drop_session('handoff_empty')
+
+
+def test_watch_loop_survives_errors(monkeypatch):
+    class Stop(BaseException):
+        pass
+
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 2:
+            raise Stop
+
+    def broken_reload():
+        raise ValueError("unknown url type: 'None/admin/handoff'")
+
+    monkeypatch.setattr(app.time, 'sleep', sleep)
+    monkeypatch.setattr(app, 'reload_cluster_config', broken_reload)
+    monkeypatch.setattr(app, '_handoff_retry_at', None)
+    monkeypatch.setattr(app, '_handoff_backoff', 0.0)
+    errors = app.error_counts.get('HANDOFF_ERROR', 0)
+    with pytest.raises(Stop):
+        app.cluster_watch_loop()
+    # Both failed iterations were logged and the loop kept going
+    assert app.error_counts.get('HANDOFF_ERROR', 0) == errors + 2
+    assert app._handoff_retry_at is not None
@@ -0,0 +1,50 @@
+"""Cost report for /debug/costs."""
+import tracemalloc
+
+import pytest
+
+import app
+import golden_harness
+
+
+def test_report_covers_states_without_costs():
+    # A restored or handed-off session has a state but no frames counted here
+    app.exercise_states['costs_restored_squat'] = {'repCounter': 3, 'stage': 'down', 'exerciseType': 'squat'}
+    app.session_summaries['costs_restored'] = {'startedAt': 0, 'lastSeen': 0, 'frames': 0, 'skippedFrames': 0,
+                                               'activeMs': 0, 'totalReps': 3, 'repsByExercise': {'squat': 3}}
+    costs = dict(app.exercise_costs)
+    app.exercise_costs.pop('squat', None)
+    app.record_frame_cost('costs_counted', 'bicepCurl', 0.001)
+    try:
+        report = app.cost_report(10)
+        squat = report['exercises']['squat']
+        assert (squat['frames'], squat['cpuMs'], squat['allocPeakBytesPerFrame']) == (0, 0.0, None)
+        assert squat['states'] >= 1
+        assert 'allocNote' in report
+    finally:
+        app.exercise_costs.clear()
+        app.exercise_costs.update(costs)
+        app.drop_session('costs_restored')
+        app.session_costs.pop('costs_counted', None)
+
+
+def test_failed_sampled_frame_stops_its_trace(monkeypatch):
+    monkeypatch.setattr(app, 'COST_ACCOUNTING', True)
+    monkeypatch.setattr(app, 'COST_ALLOC_SAMPLE_RATE', 1.0)
+
+    def broken_metrics(*args):
+        raise KeyError('bicepCurl')
+
+    # Fails after the handler, outside what the handler's own error path covers
+    monkeypatch.setattr(app, 'update_rep_metrics', broken_metrics)
+    landmarks = golden_harness.build_case('bicepCurl', 'clean10')[0][0][1]
+    visible_mask = app.validate_payload(landmarks, 'bicepCurl', 'costs_failed')[1]
+    try:
+        with pytest.raises(KeyError):
+            app.count_frame('costs_failed', 'bicepCurl', app.exercise_handlers['bicepCurl'], landmarks,
+                            visible_mask, 1000)
+        assert not tracemalloc.is_tracing()
+        assert not app._alloc_sample_lock.locked()
+    finally:
+        app.exercise_states.pop('costs_failed_bicepCurl', None)
+        app.drop_session('costs_failed')
@@ -0,0 +1,25 @@
+"""Exercise config reloads racing frames that already looked up their handler."""
+import tracemalloc
+
+import app
+import golden_harness
+
+
+def test_frame_for_an_exercise_removed_mid_request_is_unknown(monkeypatch):
+    # The handler was looked up before a reload removed the exercise's metadata
+    monkeypatch.delitem(app.EXERCISE_JOINT_GROUPS, 'bicepCurl')
+    monkeypatch.setattr(app, 'COST_ALLOC_SAMPLE_RATE', 1.0)
+    landmarks = golden_harness.build_case('bicepCurl', 'clean10')[0][0][1]
+    assert not app.frame_has_visible_group(app.ALL_VISIBLE, 'bicepCurl')
+
+    result = app.count_frame('reload_race', 'bicepCurl', app.exercise_handlers['bicepCurl'], landmarks,
+                             app.ALL_VISIBLE, 1000)
+    assert result is None
+    assert 'reload_race_bicepCurl' not in app.exercise_states
+    assert not tracemalloc.is_tracing()
+
+    response = app.app.test_client().post('/process_landmarks', json={
+        'landmarks': landmarks, 'exerciseType': 'bicepCurl', 'sessionId': 'reload_race'})
+    assert response.status_code == 400
+    assert response.get_json()['code'] == 'UNKNOWN_EXERCISE'
+    assert 'reload_race' not in app.session_summaries
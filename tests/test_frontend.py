@@ -0,0 +1,36 @@
+"""Serving the precompressed frontend (SERVE_FRONTEND=1)."""
+import gzip
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'frontend_assets', {})
+    app.build_frontend_assets()
+    return app.app.test_client()
+
+
+def test_encoding_follows_accept_encoding_qualities(client):
+    brotli = app.frontend_assets['index.html']['br'] is not None
+    assert client.get('/app/').headers.get('Content-Encoding') is None
+    response = client.get('/app/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == app.frontend_assets['index.html']['identity'][0]
+    assert client.get('/app/', headers={'Accept-Encoding': 'gzip;q=0'}).headers.get('Content-Encoding') is None
+    refused_br = client.get('/app/', headers={'Accept-Encoding': 'br;q=0, gzip'})
+    assert refused_br.headers['Content-Encoding'] == 'gzip'
+    if brotli:
+        assert client.get('/app/', headers={'Accept-Encoding': 'gzip, br'}).headers['Content-Encoding'] == 'br'
+
+
+def test_not_modified_needs_a_matching_entity_tag(client):
+    etag = client.get('/app/').headers['ETag']
+    assert client.get('/app/', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/app/', headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+    assert client.get('/app/', headers={'If-None-Match': '*'}).status_code == 304
+    # A tag that merely contains this one is a different representation
+    assert client.get('/app/', headers={'If-None-Match': etag[:-1] + '-gz"'}).status_code == 200
+    assert client.get('/app/', headers={'If-None-Match': '"other"'}).status_code == 200
@@ -0,0 +1,31 @@
+"""Rep-counting accuracy on the golden corpus, through the same count_frame path as requests."""
+import pytest
+
+import app
+import golden_harness
+
+CASES = [(exercise_type, variant) for exercise_type in golden_harness.MOVEMENTS
+         for variant in golden_harness.VARIANTS]
+
+
+# Overload level 3 skips metric smoothing; reps must still be counted on time
+SIGNAL_PARAMS = {'default': app.DEFAULT_SIGNAL_PARAMS, 'overload': app.OVERLOAD_SIGNAL_PARAMS}
+
+
+@pytest.mark.parametrize('signal_params', SIGNAL_PARAMS)
+@pytest.mark.parametrize('exercise_type,variant', CASES)
+def test_reps_match_labels(exercise_type, variant, signal_params):
+    if exercise_type not in app.exercise_handlers:
+        pytest.skip(f"{exercise_type} is not defined in this build")
+    frames, labels, period_ms = golden_harness.build_case(exercise_type, variant)
+    rep_times, _ = golden_harness.run_frames(exercise_type, frames, SIGNAL_PARAMS[signal_params])
+    assert golden_harness.check_accuracy(rep_times, labels, period_ms) is None
+
+
+def test_runs_leave_no_session_state():
+    frames = golden_harness.build_case('bicepCurl', 'clean10')[0]
+    states, summaries = len(app.exercise_states), len(app.session_summaries)
+    first, _ = golden_harness.run_frames('bicepCurl', frames)
+    second, _ = golden_harness.run_frames('bicepCurl', frames)
+    assert first == second
+    assert (len(app.exercise_states), len(app.session_summaries)) == (states, summaries)
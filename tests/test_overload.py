@@ -0,0 +1,74 @@
+"""Overload control: which signals may move the degradation level."""
+import time
+
+import pytest
+
+import app
+import golden_harness
+
+
+@pytest.fixture(autouse=True)
+def fresh_overload(monkeypatch):
+    monkeypatch.setattr(app, 'overload_queue_ms', 0.0)
+    monkeypatch.setattr(app, 'overload_busy_share', 0.0)
+    monkeypatch.setattr(app, 'overload_cpu_share', 0.0)
+    monkeypatch.setattr(app, 'overload_level', 0)
+    # Keep this process's CPU use out of the other signals' tests
+    monkeypatch.setattr(app, 'OVERLOAD_CPU_INTERVAL', float('inf'))
+
+
+def post_frames(headers):
+    client = app.app.test_client()
+    frames = golden_harness.build_case('bicepCurl', 'clean10')[0][:30]
+    for _, landmarks in frames:
+        response = client.post('/process_landmarks', headers=headers, json={
+            'landmarks': landmarks, 'exerciseType': 'bicepCurl', 'sessionId': 'overload_forged'})
+        assert response.status_code == 200
+    app.drop_session('overload_forged')
+
+
+def test_client_request_start_is_ignored_by_default(monkeypatch):
+    monkeypatch.setattr(app, 'TRUST_REQUEST_START', False)
+    post_frames({'X-Request-Start': 't=946684800000'})
+    assert app.overload_queue_ms == 0.0
+    assert app.overload_level == 0
+
+
+def test_trusted_request_start_counts_as_queue_time(monkeypatch):
+    monkeypatch.setattr(app, 'TRUST_REQUEST_START', True)
+    post_frames({'X-Request-Start': 't=946684800000'})
+    assert app.overload_level == 3
+
+
+def test_busy_threads_raise_and_release_the_level(monkeypatch):
+    monkeypatch.setattr(app, 'WORKER_THREADS', 8)
+    for _ in range(200):
+        app.update_overload_level(0.0, 7)
+    assert app.overload_level == 3
+    for _ in range(200):
+        app.update_overload_level(0.0, 0)
+    assert app.overload_level == 0
+
+
+def test_cpu_share_is_measured_without_a_proxy(monkeypatch):
+    monkeypatch.setattr(app, 'OVERLOAD_CPU_INTERVAL', 0.1)
+    monkeypatch.setattr(app, '_overload_cpu_mark', (time.monotonic(), time.process_time()))
+    deadline = time.monotonic() + 0.2
+    while time.monotonic() < deadline:
+        pass
+    app.update_overload_level(0.0, 0)
+    assert app.overload_cpu_share > 0.5
+    assert app.overload_level >= 1
+
+
+def test_bogus_request_start_is_clamped(monkeypatch):
+    monkeypatch.setattr(app, 'TRUST_REQUEST_START', True)
+    with app.app.test_request_context(headers={'X-Request-Start': 't=0'}):
+        assert app.request_queue_ms() == app.MAX_QUEUE_SAMPLE_MS
+    with app.app.test_request_context(headers={'X-Request-Start': f't={int(time.time() * 1000) + 60000}'}):
+        assert app.request_queue_ms() == 0.0
+    # One bad sample moves the average by at most alpha of the ceiling and soon decays
+    app.update_overload_level(app.MAX_QUEUE_SAMPLE_MS, 0)
+    for _ in range(20):
+        app.update_overload_level(0.0, 0)
+    assert app.overload_level == 0
@@ -0,0 +1,107 @@
+"""Result push: event stream limits and per-session serialization of frames."""
+import threading
+import time
+
+import app
+import golden_harness
+
+
+def test_streams_beyond_the_limit_are_refused(monkeypatch):
+    monkeypatch.setattr(app, 'SSE_MAX_STREAMS', 2)
+    client = app.app.test_client()
+    streams = [client.get(f'/sessions/push_{i}/events', buffered=False) for i in range(2)]
+    try:
+        assert [stream.status_code for stream in streams] == [200, 200]
+        refused = client.get('/sessions/push_2/events')
+        assert refused.status_code == 503
+        assert refused.headers['Retry-After'] == str(app.SSE_RETRY_AFTER)
+        assert refused.get_json()['code'] == 'STREAMS_FULL'
+    finally:
+        for stream in streams:
+            stream.close()
+    # Closing a stream frees its slot
+    assert app._open_streams == 0
+    stream = client.get('/sessions/push_2/events', buffered=False)
+    assert stream.status_code == 200
+    stream.close()
+
+
+def test_concurrent_frames_for_one_session_count_every_rep():
+    # Each frame is sent while the one before it is inside its handler, as
+    # overlapping requests would be; they must still be counted one at a time
+    frames, labels, _ = golden_harness.build_case('bicepCurl', 'clean30')
+    real_handler = app.exercise_handlers['bicepCurl']
+    session_id = 'push_concurrent'
+    frame_index = {current_time: i for i, (current_time, _) in enumerate(frames)}
+    entered = [threading.Event() for _ in frames]
+    counting = []
+    overlaps = []
+
+    def slow_handler(landmarks, state, current_time, *args):
+        i = frame_index[current_time]
+        entered[i].set()
+        counting.append(i)
+        if len(counting) > 1:
+            overlaps.append(i)
+        time.sleep(0.001)
+        try:
+            return real_handler(landmarks, state, current_time, *args)
+        finally:
+            counting.remove(i)
+
+    def send(i):
+        if i:
+            entered[i - 1].wait(5)
+        current_time, landmarks = frames[i]
+        visible_mask = app.validate_payload(landmarks, 'bicepCurl', session_id)[1]
+        app.count_frame(session_id, 'bicepCurl', slow_handler, landmarks, visible_mask, current_time)
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(len(frames))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert overlaps == []
+        assert app.exercise_states[f'{session_id}_bicepCurl']['repCounter'] == len(labels)
+        summary = app.session_summaries[session_id]
+        assert (summary['frames'], summary['totalReps']) == (len(frames), len(labels))
+    finally:
+        app.drop_session(session_id)
+
+
+def test_reconnect_to_a_recreated_channel_replays_its_events():
+    # The session's channel lived elsewhere (before a restart or handoff) and got to event 40
+    old = app.get_event_channel('push_moved')
+    for rep in range(40):
+        app.publish_frame_events(old, 'bicepCurl', {'repCounter': rep + 1, 'stage': 'up'}, 1)
+    last_event_id = f"{old['epoch']}-40"
+    del app.session_events['push_moved']
+
+    channel = app.get_event_channel('push_moved')
+    stream = app.stream_events(channel, last_event_id)
+    try:
+        assert next(stream) == 'retry: 1000\n\n'
+        app.publish_frame_events(channel, 'bicepCurl', {'repCounter': 41, 'stage': 'up'}, 1)
+        event = next(stream)
+        assert event.startswith(f"id: {channel['epoch']}-1\nevent: rep\n")
+        assert '"repCounter":41' in event
+    finally:
+        stream.close()
+        app.session_events.pop('push_moved', None)
+
+
+def test_reconnect_within_an_epoch_resumes_after_the_last_event():
+    channel = app.get_event_channel('push_resume')
+    for rep in range(3):
+        app.publish_frame_events(channel, 'bicepCurl', {'repCounter': rep + 1, 'stage': 'up'}, 1)
+    # Events are rep 1, the stage change, rep 2 and rep 3; the first two were seen
+    stream = app.stream_events(channel, f"{channel['epoch']}-2")
+    try:
+        next(stream)
+        event = next(stream)
+        assert event.startswith(f"id: {channel['epoch']}-3\nevent: rep\n")
+        assert '"repCounter":2' in event
+    finally:
+        stream.close()
+        app.session_events.pop('push_resume', None)
@@ -0,0 +1,148 @@
+"""Shared-memory landmark rings: the slot protocol and counting ring frames."""
+import itertools
+import os
+import struct
+from multiprocessing import shared_memory
+
+import pytest
+
+import app
+import golden_harness
+import landmark_ring
+import sharding
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def ring_pair():
+    """A producer and a consumer on a new ring; consumers are built like main() does"""
+    rings = []
+
+    def make(slots=4):
+        producer = landmark_ring.LandmarkRing.create(f'test_ring_{os.getpid()}_{next(_names)}', slots=slots)
+        consumer = landmark_ring.LandmarkRing(shared_memory.SharedMemory(name=producer.shm.name), owner=False)
+        rings.extend((consumer, producer))
+        return producer, consumer
+
+    yield make
+    for ring in rings:
+        ring.close()
+
+
+def values_for(frame):
+    return [float(frame)] * landmark_ring.LANDMARK_VALUES
+
+
+def read_one(consumer):
+    session_id, exercise_type, timestamp_ms, values = consumer.read()
+    with values:
+        first = values[0]
+    consumer.release()
+    return session_id, exercise_type, timestamp_ms, first
+
+
+def test_frames_survive_wraparound(ring_pair):
+    producer, consumer = ring_pair(slots=4)
+    for frame in range(11):
+        # In place, as a pose estimator would write
+        with producer.reserve() as slot:
+            slot[:] = memoryview(struct.pack(f'<{landmark_ring.LANDMARK_VALUES}f', *values_for(frame))).cast('f')
+        producer.commit(f'session_{frame}', 'squat', 1000 + frame)
+        assert read_one(consumer) == (f'session_{frame}', 'squat', 1000 + frame, frame)
+    assert consumer.read() is None
+    assert producer.pending() == 0
+
+
+def test_full_ring_refuses_frames_until_one_is_released(ring_pair):
+    producer, consumer = ring_pair(slots=4)
+    for frame in range(4):
+        assert producer.write('full', 'squat', values_for(frame), 1000)
+    assert producer.reserve() is None
+    assert producer.write('full', 'squat', values_for(4), 1000) is False
+    assert read_one(consumer)[3] == 0
+    assert producer.write('full', 'squat', values_for(4), 1000)
+    assert [read_one(consumer)[3] for _ in range(4)] == [1, 2, 3, 4]
+
+
+def test_out_of_sequence_slot_is_skipped(ring_pair):
+    producer, consumer = ring_pair(slots=4)
+    producer.write('seq', 'squat', values_for(0), 1000)
+    producer.write('seq', 'squat', values_for(1), 1000)
+    # Corrupt the first slot's sequence number
+    landmark_ring.INDEX.pack_into(producer.buf, producer.slot_offset(0), 7)
+    with pytest.raises(ValueError):
+        consumer.read()
+    consumer.release()
+    assert read_one(consumer)[3] == 1
+
+
+def test_undecodable_ids_are_reported_not_decoded(ring_pair):
+    producer, consumer = ring_pair(slots=4)
+    producer.write('placeholder', 'squat', values_for(0), 1000)
+    offset = producer.slot_offset(0) + struct.calcsize('<Qq')
+    producer.buf[offset:offset + 2] = b'\xe2\x82'  # The first two bytes of a three-byte character
+    producer.buf[offset + 2:offset + 11] = bytes(9)
+    with pytest.raises(ValueError, match='undecodable'):
+        consumer.read()
+
+
+def test_overlong_ids_are_rejected_not_truncated(ring_pair):
+    producer, consumer = ring_pair(slots=4)
+    shared_prefix = 'x' * landmark_ring.SESSION_BYTES
+    with pytest.raises(ValueError):
+        producer.write(shared_prefix + 'a', 'squat', values_for(0), 1000)
+    with pytest.raises(ValueError):
+        producer.write('s', 'e' * (landmark_ring.EXERCISE_BYTES + 1), values_for(0), 1000)
+    assert consumer.read() is None
+    # The reserved slot is still free for the next frame
+    assert producer.write(shared_prefix, 'squat', values_for(1), 1000)
+    assert read_one(consumer) == (shared_prefix, 'squat', 1000, 1)
+
+
+def write_case(producer, consumer, session_id, frames):
+    """Write a case's frames through a small ring, draining it whenever it fills"""
+    for current_time, landmarks in frames:
+        values = [value for point in landmarks
+                  for value in (point['x'], point['y'], point['z'], point['visibility'])]
+        while not producer.write(session_id, 'bicepCurl', values, current_time):
+            app.drain_ring(consumer)
+    app.drain_ring(consumer)
+
+
+def test_ring_frames_count_the_same_reps_as_http_frames(ring_pair, monkeypatch):
+    # The HTTP frames arrive far faster than a camera's, so lift the rate limits
+    for limit in ('RATE_LIMIT_IP_RPS', 'RATE_LIMIT_IP_BURST', 'RATE_LIMIT_SESSION_RPS', 'RATE_LIMIT_SESSION_BURST'):
+        monkeypatch.setattr(app, limit, 1e9)
+    producer, consumer = ring_pair(slots=64)
+    frames, labels, _ = golden_harness.build_case('bicepCurl', 'noisy30')
+    client = app.app.test_client()
+    try:
+        for current_time, landmarks in frames:
+            response = client.post('/process_landmarks?sessionId=ring_http', json={
+                'landmarks': landmarks, 'exerciseType': 'bicepCurl', 'sessionId': 'ring_http'})
+            assert response.status_code == 200
+        write_case(producer, consumer, 'ring_shm', frames)
+
+        ring_summary = app.session_summaries['ring_shm']
+        assert ring_summary['frames'] == len(frames)
+        assert ring_summary['totalReps'] == len(labels)
+        assert app.exercise_states['ring_shm_bicepCurl']['repCounter'] == \
+            app.exercise_states['ring_http_bicepCurl']['repCounter']
+    finally:
+        app.drop_session('ring_http')
+        app.drop_session('ring_shm')
+
+
+def test_ring_frames_for_another_nodes_session_are_dropped(ring_pair, monkeypatch):
+    nodes = ['http://node-a:5000', 'http://node-b:5000']
+    monkeypatch.setattr(app, 'cluster_nodes', nodes)
+    monkeypatch.setattr(app, 'shard_ring', sharding.build_ring(nodes))
+    monkeypatch.setattr(app, 'NODE_URL', nodes[0])
+    session_id = next(f'ring_foreign_{i}' for i in itertools.count()
+                      if sharding.ring_node(app.shard_ring, f'ring_foreign_{i}') == nodes[1])
+    producer, consumer = ring_pair(slots=64)
+    errors = app.error_counts.get('WRONG_SHARD', 0)
+    write_case(producer, consumer, session_id, golden_harness.build_case('bicepCurl', 'clean10')[0][:5])
+    assert session_id not in app.session_summaries
+    assert app.error_counts.get('WRONG_SHARD', 0) == errors + 5